@@ -0,0 +1,37 @@
+import importlib
+
+__version__ = "0.1.0"
+
+# Submodules load on first attribute access so `import immoscout_scraper` stays cheap
+_exports = {
+    "SearchData": "models",
+    "CostData": "models",
+    "DataPipeline": "pipeline",
+    "SeenIndex": "dedup",
+    "ResultStore": "query",
+    "PriceHistory": "history",
+    "get_scrapeops_url": "proxy",
+    "get_request_template": "proxy",
+    "RequestTemplate": "proxy",
+    "load_config": "config",
+    "scrape_search_results": "scraper",
+    "start_scrape": "scraper",
+    "process_listing": "scraper",
+    "process_results": "scraper",
+    "ParseError": "extract",
+    "CrawlScheduler": "scheduler",
+    "SqliteTaskQueue": "distributed",
+    "RedisTaskQueue": "distributed",
+    "open_task_queue": "distributed",
+    "profiler": "profiling",
+    "setup_logging": "logs",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(f".{_exports[name]}", __name__)
+    return getattr(module, name)
@@ -0,0 +1,138 @@
+import os
+import gzip
+import json
+import time
+import logging
+import threading
+import concurrent.futures
+from dataclasses import asdict
+
+logger = logging.getLogger(__name__)
+
+
+class PageArchive:
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.data_file = open(path, "ab")
+        self.index_file = open(self.index_path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def append(self, url, stage, body, meta=None):
+        # Every page is its own gzip member, so the archive as a whole is still a valid gzip stream
+        member = gzip.compress(body, compresslevel=6)
+        with self.lock:
+            offset = self.data_file.tell()
+            self.data_file.write(member)
+            self.data_file.flush()
+            entry = {"offset": offset, "length": len(member), "stage": stage, "url": url, "time": time.time()}
+            if meta:
+                entry["meta"] = meta
+            self.index_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.index_file.flush()
+
+    def close(self):
+        with self.lock:
+            self.data_file.close()
+            self.index_file.close()
+
+
+class ArchiveRecorder:
+
+    def __init__(self):
+        self.archive = None
+        self.path = None
+
+    @property
+    def enabled(self):
+        return self.archive is not None
+
+    def open(self, path):
+        self.close()
+        self.path = path
+        self.archive = PageArchive(path)
+
+    def record(self, url, stage, body, meta=None):
+        if self.archive is not None and body:
+            self.archive.append(url, stage, body, meta=meta)
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+
+page_archive = ArchiveRecorder()
+
+
+def read_index(path):
+    entries = []
+    with open(f"{path}.idx", encoding="utf-8") as index_file:
+        for line in index_file:
+            if line.strip():
+                entries.append(json.loads(line))
+    return entries
+
+
+def read_body(data_file, entry):
+    data_file.seek(entry["offset"])
+    return gzip.decompress(data_file.read(entry["length"]))
+
+
+def reextract_chunk(path, entries):
+    from .models import CostData
+    from .scraper import parse_search_page, parse_detail_page
+
+    search_rows = []
+    cost_rows = []
+    failures = 0
+    with open(path, "rb") as data_file:
+        for entry in entries:
+            html = read_body(data_file, entry).decode("utf-8", errors="replace")
+            try:
+                if entry["stage"] == "search":
+                    search_rows.extend(asdict(search_data) for search_data in parse_search_page(html))
+                else:
+                    values = parse_detail_page(html)
+                    cost_rows.append(asdict(CostData(
+                        name=entry.get("meta", {}).get("name", entry["url"]),
+                        cold_rent=values["cold_rent"],
+                        price_per_m2=values["price_per_m2"],
+                        additional_costs=values["additional_costs"],
+                        total_cost=values["total_cost"],
+                        url=entry["url"]
+                    )))
+            except Exception as e:
+                failures += 1
+                logger.warning("Re-extraction failed for %s: %s", entry["url"], e)
+    return search_rows, cost_rows, failures
+
+
+def reextract_archive(path, output_prefix="reextract", workers=None, chunk_size=200):
+    from .models import SearchData, CostData
+    from .pipeline import DataPipeline
+
+    # Newest copies first, so the pipelines' dedup keeps the latest version of every page
+    entries = sorted(read_index(path), key=lambda entry: entry["time"], reverse=True)
+    chunks = [entries[start:start + chunk_size] for start in range(0, len(entries), chunk_size)]
+    search_filename = f"{output_prefix}-search.csv"
+    cost_filename = f"{output_prefix}-detail.csv"
+    # The pipelines append, so output from an earlier re-extraction has to go first
+    for filename in (search_filename, cost_filename):
+        if os.path.exists(filename):
+            os.remove(filename)
+    search_pipeline = DataPipeline(csv_filename=search_filename)
+    cost_pipeline = DataPipeline(csv_filename=cost_filename)
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for search_rows, cost_rows, chunk_failures in executor.map(reextract_chunk, [path] * len(chunks), chunks):
+            for row in search_rows:
+                search_pipeline.add_data(SearchData(**row))
+            for row in cost_rows:
+                cost_pipeline.add_data(CostData(**row))
+            failures += chunk_failures
+    search_pipeline.close_pipeline()
+    cost_pipeline.close_pipeline()
+    logger.info("Re-extracted %s archived pages, %s failed", len(entries), failures)
+    return search_pipeline.output_files + cost_pipeline.output_files
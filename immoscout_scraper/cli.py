@@ -0,0 +1,376 @@
+import logging
+import argparse
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 3
+MAX_THREADS = 5
+PAGES = 3
+LOCATION = "de"
+
+
+def parse_city(value):
+    state, _, city = value.partition("/")
+    if not city:
+        raise argparse.ArgumentTypeError("cities look like state/city, e.g. bayern/muenchen")
+    return {"state": state, "city": city}
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", help="config file holding the ScrapeOps api_key (default: config.json)")
+    common.add_argument("--location", default=LOCATION)
+    common.add_argument("--retries", type=int, default=MAX_RETRIES)
+    common.add_argument("--threads", type=int, default=MAX_THREADS)
+    common.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    common.add_argument("--metrics-file", help="write periodic metrics snapshots to this file")
+    common.add_argument("--metrics-interval", type=int, default=30)
+    common.add_argument("--profile", action="store_true", help="record per URL stage timings")
+    common.add_argument("--profile-report", default="profile-report.txt")
+    common.add_argument("--profile-top", type=int, default=20)
+    common.add_argument("--profiler", choices=["cprofile", "sampling"], help="attach a profiler to every worker")
+    common.add_argument("--hedge", action="store_true", help="send a duplicate request when one runs past the p95 latency")
+    common.add_argument("--hedge-max-ratio", type=float, default=0.05, help="cap on duplicate requests as a share of all requests")
+    common.add_argument("--archive", help="append every fetched page to this compressed archive for offline re-extraction")
+    common.add_argument("--price-history", help="directory of the change-only price history store")
+    common.add_argument("--quarantine", help="keep pages that fetched but failed to parse here instead of refetching them")
+    common.add_argument("--credit-budget", type=int, help="stop fetching once this many proxy credits are spent")
+    common.add_argument(
+        "--credit-degrade-at",
+        type=float,
+        default=0.8,
+        help="share of the credit budget after which detail pages are skipped (default: 0.8)"
+    )
+    common.add_argument("--log-level", default="INFO")
+    common.add_argument("--log-json", action="store_true", help="write one JSON object per log line")
+
+    cities = argparse.ArgumentParser(add_help=False)
+    cities.add_argument(
+        "--city",
+        dest="cities",
+        action="append",
+        type=parse_city,
+        help="state/city to crawl, may be repeated (default: bayern/muenchen)"
+    )
+    cities.add_argument("--pages", type=int, default=PAGES)
+    cities.add_argument("--compress", choices=["gzip", "zstd"], help="compress crawl output shards")
+    cities.add_argument("--rotate-mb", type=float, help="start a new output shard after this many megabytes")
+    cities.add_argument("--rotate-minutes", type=float, help="start a new output shard after this many minutes")
+
+    # Only the commands whose pipelines honour them take the output and dedup flags
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument(
+        "--near-duplicates",
+        action="store_true",
+        help="collapse reposts of the same flat (similar address, same price and size) before the detail stage"
+    )
+    output.add_argument("--near-dup-threshold", type=float, default=0.75, help="estimated similarity that counts as a repost")
+    output.add_argument("--jsonl", help="also stream records as JSON lines to a file, - for stdout, unix:PATH or tcp://HOST:PORT")
+    output.add_argument("--no-csv", dest="write_csv", action="store_false", help="skip CSV output, e.g. with --jsonl")
+
+    seen = argparse.ArgumentParser(add_help=False)
+    seen.add_argument("--seen-index", help="SQLite file of expose IDs shared across runs; known listings are only refetched once they change")
+
+    recrawl = argparse.ArgumentParser(add_help=False)
+    recrawl.add_argument(
+        "--recrawl-budget",
+        type=int,
+        help="with --seen-index, refetch at most this many known listings, the likeliest to have changed first"
+    )
+
+    broker = argparse.ArgumentParser(add_help=False)
+    broker.add_argument("--broker", default="crawl-queue.db", help="SQLite file or redis:// URL")
+
+    parser = argparse.ArgumentParser(prog="immoscout", description="ImmoScout24 search crawler and detail scraper")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("crawl", parents=[common, output, seen, cities], help="crawl search pages into {state}-{city}.csv")
+    scrape = commands.add_parser("scrape", parents=[common, output, seen, recrawl], help="scrape detail pages listed in crawl CSV files")
+    scrape.add_argument("csv_files", nargs="+")
+    commands.add_parser("run", parents=[common, output, seen, cities, recrawl], help="crawl search pages and scrape their detail pages")
+    commands.add_parser("enqueue", parents=[common, cities, broker], help="queue search pages for distributed workers")
+    worker = commands.add_parser("worker", parents=[common, broker], help="run distributed queue workers")
+    worker.add_argument("--workers", type=int, default=MAX_THREADS)
+    worker.add_argument("--visibility-timeout", type=int, default=300)
+    worker.add_argument("--idle-timeout", type=int, default=30)
+    commands.add_parser("status", parents=[common, broker], help="show distributed queue counts")
+    reextract = commands.add_parser("reextract", parents=[common], help="run the current parsers over a page archive")
+    reextract.add_argument("archive_path")
+    reextract.add_argument("--output-prefix", default="reextract")
+    reextract.add_argument("--workers", type=int, help="parser processes (default: all cores)")
+    daemon = commands.add_parser(
+        "daemon",
+        parents=[common, output, seen, cities],
+        help="keep a warm worker pool and take crawl jobs over HTTP; --city and --pages are job defaults"
+    )
+    daemon.add_argument("--listen", default="127.0.0.1:8765", help="host:port for the job API")
+    daemon.add_argument("--socket", help="serve the job API on this unix socket instead")
+    ingest = commands.add_parser("ingest", parents=[common], help="load crawl and COST- CSV files into a query database")
+    ingest.add_argument("csv_files", nargs="+")
+    ingest.add_argument("--results-db", default="results.db")
+    query = commands.add_parser("query", parents=[common], help="query ingested listings, or serve them over HTTP")
+    query.add_argument("--results-db", default="results.db")
+    query.add_argument("--city", help="state-city, e.g. bayern-muenchen")
+    for name in ("min-price", "max-price", "min-size", "max-size", "max-total-cost"):
+        query.add_argument(f"--{name}", type=float)
+    query.add_argument("--available-after", help="YYYY-MM-DD")
+    query.add_argument("--available-before", help="YYYY-MM-DD")
+    query.add_argument("--order-by", default="price")
+    query.add_argument("--descending", action="store_true")
+    query.add_argument("--limit", type=int, default=50)
+    query.add_argument("--offset", type=int, default=0)
+    query.add_argument("--serve", metavar="HOST:PORT", help="serve GET /listings with the same filters as query parameters")
+    history = commands.add_parser("history", parents=[common], help="show a listing's price history or recent price drops")
+    history_query = history.add_mutually_exclusive_group(required=True)
+    history_query.add_argument("--listing", help="expose ID whose recorded changes to show")
+    history_query.add_argument("--drops-since", metavar="YYYY-MM-DD", help="listings that got cheaper since this date")
+    history.add_argument("--field", choices=["price", "total_cost"], default="price")
+    reprocess = commands.add_parser("reprocess", parents=[common, output], help="retry the parsers on quarantined pages")
+    reprocess.add_argument("quarantine_path")
+    return parser
+
+
+def open_seen_index(args):
+    if not getattr(args, "seen_index", None):
+        return None
+    from .dedup import SeenIndex
+
+    return SeenIndex(args.seen_index)
+
+
+def open_near_duplicates(args):
+    if not getattr(args, "near_duplicates", False):
+        return None
+    from .neardup import NearDuplicateIndex
+
+    return NearDuplicateIndex(threshold=args.near_dup_threshold)
+
+
+def run_command(args):
+    seen_index = open_seen_index(args)
+    jsonl_sink = None
+    if getattr(args, "jsonl", None):
+        from .writers import JsonLinesSink
+
+        jsonl_sink = JsonLinesSink(args.jsonl)
+    try:
+        run_stage(args, seen_index, {
+            "jsonl_sink": jsonl_sink,
+            "write_csv": getattr(args, "write_csv", True),
+            "near_duplicates": open_near_duplicates(args),
+        })
+    finally:
+        if seen_index is not None:
+            seen_index.close()
+        if jsonl_sink is not None:
+            jsonl_sink.close()
+
+
+def crawl_pipeline_options(args, output_options):
+    return {
+        "compression": args.compress,
+        "rotate_bytes": int(args.rotate_mb * 1024 * 1024) if args.rotate_mb else None,
+        "rotate_seconds": args.rotate_minutes * 60 if args.rotate_minutes else None,
+        **output_options,
+    }
+
+
+def run_stage(args, seen_index, output_options):
+    if args.command == "crawl" or args.command == "run":
+        from .scheduler import CrawlScheduler
+
+        logger.info("Crawl starting...")
+        scheduler = CrawlScheduler(
+            args.location,
+            max_threads=args.threads,
+            retries=args.retries,
+            detail=args.command == "run",
+            seen_index=seen_index,
+            recrawl_budget=getattr(args, "recrawl_budget", None),
+            pipeline_options=crawl_pipeline_options(args, output_options),
+            detail_pipeline_options=output_options
+        )
+        for keyword in args.cities:
+            scheduler.add_city(keyword, args.pages)
+        aggregate_files = scheduler.run()
+        logger.info("Crawl complete: %s", ", ".join(aggregate_files))
+    elif args.command == "scrape" and args.recrawl_budget is not None and seen_index is not None:
+        from .recrawl import plan_recrawl
+        from .neardup import collapse_rows
+        from .scraper import read_rows, process_rows
+
+        rows = read_rows(args.csv_files)
+        if output_options["near_duplicates"] is not None:
+            rows = collapse_rows(rows, output_options["near_duplicates"])
+        process_rows(
+            plan_recrawl(rows, seen_index, args.recrawl_budget),
+            args.location,
+            max_threads=args.threads,
+            retries=args.retries,
+            seen_index=seen_index,
+            pipeline_options=output_options
+        )
+    elif args.command == "scrape":
+        from .scraper import process_results
+
+        for csv_file in args.csv_files:
+            process_results(
+                csv_file,
+                args.location,
+                max_threads=args.threads,
+                retries=args.retries,
+                seen_index=seen_index,
+                pipeline_options=output_options
+            )
+    elif args.command == "enqueue":
+        from .distributed import open_task_queue, enqueue_crawl
+
+        enqueue_crawl(open_task_queue(args.broker), args.cities, args.pages)
+        logger.info("Queued %s pages for %s cities on %s", args.pages, len(args.cities), args.broker)
+    elif args.command == "worker":
+        from .distributed import start_workers
+
+        start_workers(
+            args.broker,
+            args.location,
+            workers=args.workers,
+            visibility_timeout=args.visibility_timeout,
+            max_attempts=args.retries + 1,
+            idle_timeout=args.idle_timeout,
+            structured_logs=args.log_json
+        )
+    elif args.command == "status":
+        from .distributed import open_task_queue
+
+        logger.info("Queue status: %s", open_task_queue(args.broker).counts())
+    elif args.command == "reextract":
+        from .archive import reextract_archive
+
+        output_files = reextract_archive(args.archive_path, output_prefix=args.output_prefix, workers=args.workers)
+        logger.info("Re-extraction written to %s", ", ".join(output_files))
+    elif args.command == "daemon":
+        from .daemon import CrawlDaemon, serve_daemon
+
+        crawl_daemon = CrawlDaemon(
+            args.location,
+            max_threads=args.threads,
+            retries=args.retries,
+            seen_index=seen_index,
+            pipeline_options=crawl_pipeline_options(args, output_options),
+            detail_pipeline_options=output_options,
+            default_cities=args.cities,
+            default_pages=args.pages
+        )
+        serve_daemon(crawl_daemon, listen=args.listen, socket_path=args.socket)
+    elif args.command == "ingest":
+        from .query import ResultStore, ingest_files
+
+        store = ResultStore(args.results_db)
+        try:
+            ingest_files(store, args.csv_files)
+        finally:
+            store.close()
+    elif args.command == "query":
+        import json
+        from .query import ResultStore, serve_results
+
+        store = ResultStore(args.results_db)
+        try:
+            if args.serve:
+                host, _, port = args.serve.rpartition(":")
+                serve_results(store, host=host or "127.0.0.1", port=int(port))
+                return
+            result = store.query(
+                city=args.city,
+                min_price=args.min_price,
+                max_price=args.max_price,
+                min_size=args.min_size,
+                max_size=args.max_size,
+                available_after=args.available_after,
+                available_before=args.available_before,
+                max_total_cost=args.max_total_cost,
+                order_by=args.order_by,
+                descending=args.descending,
+                limit=args.limit,
+                offset=args.offset
+            )
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+        finally:
+            store.close()
+    elif args.command == "history":
+        import json
+        from .history import price_history, parse_since
+
+        if not price_history.enabled:
+            raise SystemExit("history needs --price-history DIR")
+        if args.listing:
+            result = price_history.store.history(args.listing)
+        else:
+            result = price_history.store.drops_since(parse_since(args.drops_since), field=args.field)
+        print(json.dumps(result, indent=2))
+    elif args.command == "reprocess":
+        from .quarantine import reprocess_quarantine
+
+        reprocess_quarantine(args.quarantine_path, pipeline_options=output_options)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if getattr(args, "cities", False) is None:
+        args.cities = [{"state": "bayern", "city": "muenchen"}]
+
+    from .logs import setup_logging
+
+    setup_logging(level=args.log_level.upper(), structured=args.log_json)
+    if args.config:
+        from .config import load_config
+
+        load_config(args.config)
+    if args.profile:
+        from .profiling import profiler
+
+        profiler.enable(report_filename=args.profile_report, top_n=args.profile_top, mode=args.profiler)
+
+    if args.archive:
+        from .archive import page_archive
+
+        page_archive.open(args.archive)
+    if args.quarantine:
+        from .quarantine import page_quarantine
+
+        page_quarantine.open(args.quarantine)
+    if args.price_history:
+        from .history import price_history
+
+        price_history.open(args.price_history)
+
+    from .credits import credit_ledger
+
+    credit_ledger.configure(budget=args.credit_budget, degrade_at=args.credit_degrade_at)
+    if args.hedge:
+        from .fetch import hedging
+
+        hedging.configure(max_ratio=args.hedge_max_ratio)
+
+    stop_snapshots = None
+    if args.metrics_port or args.metrics_file:
+        from .metrics import start_metrics_server, start_metrics_snapshots
+
+        if args.metrics_port:
+            start_metrics_server(args.metrics_port)
+        if args.metrics_file:
+            stop_snapshots = start_metrics_snapshots(args.metrics_file, interval=args.metrics_interval)
+
+    try:
+        run_command(args)
+    finally:
+        if stop_snapshots:
+            stop_snapshots()
+        credit_ledger.log_summary()
+        if args.profile:
+            profiler.write_report(force=True)
+        if args.archive:
+            page_archive.close()
+        if args.quarantine:
+            page_quarantine.close()
+        if args.price_history:
+            price_history.close()
@@ -0,0 +1,18 @@
+import os
+import json
+
+CONFIG_FILENAME = os.environ.get("IMMOSCOUT_CONFIG", "config.json")
+
+_config = None
+
+
+def load_config(config_filename=None):
+    global _config
+    if _config is None or config_filename:
+        with open(config_filename or CONFIG_FILENAME, "r") as config_file:
+            _config = json.load(config_file)
+    return _config
+
+
+def get_api_key():
+    return load_config()["api_key"]
@@ -0,0 +1,88 @@
+import logging
+import threading
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BudgetExhausted(Exception):
+    pass
+
+
+class CreditLedger:
+
+    def __init__(self):
+        self.budget = None
+        self.degrade_at = 0.8
+        self.spent = 0
+        self.by_account = {}
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def configure(self, budget=None, degrade_at=0.8):
+        self.budget = budget
+        self.degrade_at = degrade_at
+
+    def reserve(self, credits):
+        # Checking and spending happen under one lock, so concurrent workers can't overrun the budget
+        with self.lock:
+            if self.budget is not None and self.spent + credits > self.budget:
+                return False
+            self.spent += credits
+            return True
+
+    def release(self, credits):
+        with self.lock:
+            self.spent -= credits
+
+    def charge(self, stage, city, credits, pages=1, reserved=0):
+        city = city or "unknown"
+        with self.lock:
+            self.spent += credits - reserved
+            key = (stage, city)
+            self.by_account[key] = self.by_account.get(key, 0) + credits
+            # Escalations and hedges bill the same page again, so pages are counted apart from requests
+            self.pages[stage] = self.pages.get(stage, 0) + pages
+        metrics.inc("proxy_credits_total", credits, stage=stage, city=city)
+
+    def count_page(self, stage):
+        with self.lock:
+            self.pages[stage] = self.pages.get(stage, 0) + 1
+
+    @property
+    def remaining(self):
+        if self.budget is None:
+            return None
+        return max(self.budget - self.spent, 0)
+
+    def allows(self, credits=0):
+        return self.budget is None or self.spent + credits <= self.budget
+
+    @property
+    def degraded(self):
+        # Past this share of the budget only the cheap, listing-rich search pages still run
+        return self.budget is not None and self.spent >= self.degrade_at * self.budget
+
+    def average_cost(self, stage, default):
+        with self.lock:
+            pages = self.pages.get(stage, 0)
+            if not pages:
+                return default
+            spent = sum(credits for (account_stage, _), credits in self.by_account.items() if account_stage == stage)
+        return spent / pages
+
+    def log_summary(self):
+        with self.lock:
+            accounts = sorted(self.by_account.items())
+        if not accounts:
+            return
+        for (stage, city), credits in accounts:
+            logger.info("Proxy credits for %s pages in %s: %s", stage, city, credits)
+        if self.budget is None:
+            logger.info("Proxy credits spent: %s", self.spent)
+        else:
+            logger.info("Proxy credits spent: %s of %s", self.spent, self.budget)
+
+
+credit_ledger = CreditLedger()
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+import socketserver
+import concurrent.futures
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .scheduler import CrawlScheduler
+
+logger = logging.getLogger(__name__)
+
+JOB_STAGES = ("search", "detail")
+
+
+@dataclass
+class CrawlJob:
+    id: str
+    cities: list
+    pages: int
+    stages: list
+    status: str = "queued"
+    submitted: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+    output_files: list = field(default_factory=list)
+    error: str = None
+
+
+def parse_job_cities(cities):
+    parsed = []
+    for city in cities:
+        if isinstance(city, str):
+            state, _, name = city.partition("/")
+            city = {"state": state, "city": name}
+        if not isinstance(city, dict) or not city.get("state") or not city.get("city"):
+            raise ValueError(f"cities look like state/city, e.g. bayern/muenchen, got {city!r}")
+        parsed.append({"state": city["state"], "city": city["city"]})
+    return parsed
+
+
+class CrawlDaemon:
+
+    def __init__(self, location, max_threads=5, retries=3, seen_index=None, pipeline_options=None,
+                 detail_pipeline_options=None, default_cities=None, default_pages=3, history=1000):
+        self.location = location
+        self.default_cities = default_cities or [{"state": "bayern", "city": "muenchen"}]
+        self.default_pages = default_pages
+        self.max_threads = max_threads
+        self.retries = retries
+        self.seen_index = seen_index
+        self.pipeline_options = pipeline_options or {}
+        self.detail_pipeline_options = detail_pipeline_options or {}
+        self.history = history
+        # Every job runs on the same threads, so only the first one pays for their start up
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="crawl-worker")
+        self.jobs = OrderedDict()
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.runner = threading.Thread(target=self.run_jobs, daemon=True)
+
+    def start(self):
+        self.runner.start()
+        return self
+
+    def submit(self, spec):
+        cities = parse_job_cities(spec.get("cities") or self.default_cities)
+        pages = int(spec.get("pages", self.default_pages))
+        stages = list(spec.get("stages") or JOB_STAGES)
+        unknown = [stage for stage in stages if stage not in JOB_STAGES]
+        if unknown or "search" not in stages:
+            raise ValueError(f"stages must include search and be drawn from {', '.join(JOB_STAGES)}")
+        job = CrawlJob(uuid.uuid4().hex[:12], cities, pages, stages)
+        with self.lock:
+            self.jobs[job.id] = job
+            # Finished jobs beyond the history limit are forgotten, oldest first
+            while len(self.jobs) > self.history:
+                oldest = next(iter(self.jobs.values()))
+                if oldest.status in ("queued", "running"):
+                    break
+                self.jobs.popitem(last=False)
+        self.pending.put(job)
+        logger.info("Queued job %s: %s pages of %s", job.id, pages, ", ".join(f"{c['state']}/{c['city']}" for c in cities))
+        return job
+
+    def job_status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return asdict(job) if job is not None else None
+
+    def list_jobs(self):
+        with self.lock:
+            return [asdict(job) for job in self.jobs.values()]
+
+    def run_jobs(self):
+        while True:
+            job = self.pending.get()
+            if job is None:
+                return
+            self.run_job(job)
+
+    def run_job(self, job):
+        with self.lock:
+            job.status = "running"
+            job.started = time.time()
+        output_files, error = [], None
+        try:
+            scheduler = CrawlScheduler(
+                self.location,
+                max_threads=self.max_threads,
+                retries=self.retries,
+                detail="detail" in job.stages,
+                seen_index=self.seen_index,
+                pipeline_options=self.pipeline_options,
+                detail_pipeline_options=self.detail_pipeline_options
+            )
+            for keyword in job.cities:
+                scheduler.add_city(keyword, job.pages)
+            output_files = scheduler.run(executor=self.pool)
+        except Exception as e:
+            logger.error("Job %s failed: %s", job.id, e)
+            error = str(e)
+        if self.seen_index is not None:
+            self.seen_index.flush()
+        with self.lock:
+            job.output_files = output_files
+            job.error = error
+            job.status = "failed" if error else "done"
+            job.finished = time.time()
+        logger.info("Job %s %s in %.1fs", job.id, job.status, job.finished - job.started)
+
+    def close(self):
+        self.pending.put(None)
+        self.runner.join()
+        self.pool.shutdown()
+
+
+class JobApiHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        crawl_daemon = self.server.crawl_daemon
+        if self.path == "/jobs":
+            self.send_json(200, crawl_daemon.list_jobs())
+        elif self.path.startswith("/jobs/"):
+            job = crawl_daemon.job_status(self.path[len("/jobs/"):])
+            if job is None:
+                self.send_json(404, {"error": "no such job"})
+            else:
+                self.send_json(200, job)
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok", "queued": crawl_daemon.pending.qsize()})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            spec = json.loads(self.rfile.read(length) or b"{}")
+            job = self.server.crawl_daemon.submit(spec)
+        except (ValueError, TypeError, AttributeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(202, asdict(job))
+
+    def address_string(self):
+        # Unix socket peers have no host to show
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_daemon(crawl_daemon, listen="127.0.0.1:8765", socket_path=None):
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, JobApiHandler)
+        logger.info("Accepting crawl jobs on unix:%s", socket_path)
+    else:
+        host, _, port = listen.rpartition(":")
+        server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), JobApiHandler)
+        logger.info("Accepting crawl jobs on http://%s:%s/jobs", *server.server_address[:2])
+    server.crawl_daemon = crawl_daemon
+    crawl_daemon.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down, waiting for queued jobs")
+    finally:
+        server.server_close()
+        crawl_daemon.close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
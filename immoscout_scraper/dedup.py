@@ -0,0 +1,164 @@
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+EXPOSE_ID_PATTERN = re.compile(r"/expose/(\d+)")
+
+
+def expose_id(url):
+    match = EXPOSE_ID_PATTERN.search(url or "")
+    return match.group(1) if match else None
+
+
+def card_fingerprint(row):
+    # Price and size are what a detail refetch would be for; the rest of the card is cosmetic
+    key = f"{row.get('price', '')}|{row.get('size', '')}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def content_hash(values):
+    return hashlib.sha1(json.dumps(values, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class SeenIndex:
+
+    def __init__(self, db_filename="seen-listings.db", commit_every=200):
+        self.db_filename = db_filename
+        self.commit_every = commit_every
+        self.pending_writes = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_filename, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS listings (
+                expose_id TEXT PRIMARY KEY,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                detail_fetched REAL
+            ) WITHOUT ROWID
+        """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS details (
+                expose_id TEXT PRIMARY KEY,
+                card_fingerprint TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                fetched REAL,
+                checked REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS detail_changes (
+                expose_id TEXT PRIMARY KEY,
+                observations INTEGER NOT NULL,
+                changes INTEGER NOT NULL,
+                first_observed REAL NOT NULL,
+                last_observed REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self.connection.commit()
+
+    def write(self, sql, params):
+        self.connection.execute(sql, params)
+        self.pending_writes += 1
+        # Writes are batched into one transaction; a crash loses at most commit_every sightings
+        if self.pending_writes >= self.commit_every:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def check_and_add(self, listing_id):
+        now = time.time()
+        with self.lock:
+            known = self.connection.execute(
+                "SELECT 1 FROM listings WHERE expose_id = ?", (listing_id,)
+            ).fetchone() is not None
+            if known:
+                self.write("UPDATE listings SET last_seen = ? WHERE expose_id = ?", (now, listing_id))
+            else:
+                self.write("INSERT INTO listings (expose_id, first_seen, last_seen) VALUES (?, ?, ?)", (listing_id, now, now))
+        return known
+
+    def mark_detail_fetched(self, listing_id):
+        now = time.time()
+        with self.lock:
+            self.write("""
+                INSERT INTO listings (expose_id, first_seen, last_seen, detail_fetched) VALUES (?, ?, ?, ?)
+                ON CONFLICT (expose_id) DO UPDATE SET detail_fetched = excluded.detail_fetched
+            """, (listing_id, now, now, now))
+
+    def detail_state(self, listing_id):
+        with self.lock:
+            row = self.connection.execute("""
+                SELECT card_fingerprint, etag, last_modified, content_hash, fetched, checked
+                FROM details WHERE expose_id = ?
+            """, (listing_id,)).fetchone()
+        if row is None:
+            return None
+        keys = ("card_fingerprint", "etag", "last_modified", "content_hash", "fetched", "checked")
+        return dict(zip(keys, row))
+
+    def record_detail(self, listing_id, card_fingerprint=None, etag=None, last_modified=None, content_hash=None):
+        self.mark_detail_fetched(listing_id)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT content_hash FROM details WHERE expose_id = ?", (listing_id,)
+            ).fetchone()
+            self.observe(listing_id, row is not None and row[0] != content_hash, now)
+            self.write("""
+                INSERT INTO details (expose_id, card_fingerprint, etag, last_modified, content_hash, fetched, checked)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (expose_id) DO UPDATE SET
+                    card_fingerprint = excluded.card_fingerprint,
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    content_hash = excluded.content_hash,
+                    fetched = excluded.fetched,
+                    checked = excluded.checked
+            """, (listing_id, card_fingerprint, etag, last_modified, content_hash, now, now))
+
+    def mark_detail_unchanged(self, listing_id, card_fingerprint=None, observed=True):
+        # Only the check time moves, so an unchanged listing costs one small row update
+        now = time.time()
+        with self.lock:
+            # A matching search card says nothing about the rest of the detail page
+            if observed:
+                self.observe(listing_id, False, now)
+            self.write("""
+                UPDATE details SET checked = ?, card_fingerprint = COALESCE(?, card_fingerprint)
+                WHERE expose_id = ?
+            """, (now, card_fingerprint, listing_id))
+
+    def observe(self, listing_id, changed, now):
+        self.write("""
+            INSERT INTO detail_changes (expose_id, observations, changes, first_observed, last_observed)
+            VALUES (?, 1, ?, ?, ?)
+            ON CONFLICT (expose_id) DO UPDATE SET
+                observations = observations + 1,
+                changes = changes + excluded.changes,
+                last_observed = excluded.last_observed
+        """, (listing_id, int(changed), now, now))
+
+    def change_history(self, listing_id):
+        with self.lock:
+            row = self.connection.execute("""
+                SELECT observations, changes, first_observed, last_observed
+                FROM detail_changes WHERE expose_id = ?
+            """, (listing_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("observations", "changes", "first_observed", "last_observed"), row))
+
+    def flush(self):
+        with self.lock:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,357 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import logging
+import sqlite3
+import multiprocessing
+from dataclasses import asdict
+
+from .archive import page_archive
+from .extract import ParseError
+from .quarantine import page_quarantine
+from .history import price_history
+from .logs import setup_logging
+from .pipeline import DataPipeline
+from .profiling import profiler
+from .scheduler import STAGE_PRIORITIES
+from .scraper import scrape_search_results, process_listing
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteTaskQueue:
+
+    def __init__(self, db_filename="crawl-queue.db", visibility_timeout=300, max_attempts=3):
+        self.db_filename = db_filename
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(db_filename, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                dedup_key TEXT UNIQUE,
+                stage TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_until REAL,
+                worker_id TEXT,
+                result TEXT,
+                error TEXT
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (status, priority, id)")
+
+    def put(self, stage, payload, dedup_key=None, priority=None):
+        if priority is None:
+            priority = STAGE_PRIORITIES[stage]
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO tasks (dedup_key, stage, priority, payload) VALUES (?, ?, ?, ?)",
+            (dedup_key, stage, priority, json.dumps(payload))
+        )
+        return cursor.rowcount == 1
+
+    def lease(self, worker_id):
+        now = time.time()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            # A task that keeps outliving its lease keeps crashing its worker; stop handing it out
+            self.connection.execute("""
+                UPDATE tasks SET status = 'failed', lease_until = NULL, error = 'lease expired'
+                WHERE status = 'leased' AND lease_until < ? AND attempts >= ?
+            """, (now, self.max_attempts))
+            # Leases that ran past the visibility timeout belong to crashed workers
+            row = self.connection.execute("""
+                SELECT id, stage, payload FROM tasks
+                WHERE status = 'queued' OR (status = 'leased' AND lease_until < ?)
+                ORDER BY priority, id LIMIT 1
+            """, (now,)).fetchone()
+            if row is None:
+                self.connection.execute("COMMIT")
+                return None
+            self.connection.execute(
+                "UPDATE tasks SET status = 'leased', lease_until = ?, worker_id = ?, attempts = attempts + 1 WHERE id = ?",
+                (now + self.visibility_timeout, worker_id, row[0])
+            )
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        return {"id": row[0], "stage": row[1], "payload": json.loads(row[2])}
+
+    def complete(self, task_id, result=None):
+        self.connection.execute(
+            "UPDATE tasks SET status = 'done', lease_until = NULL, result = ? WHERE id = ?",
+            (json.dumps(result), task_id)
+        )
+
+    def fail(self, task_id, error):
+        self.connection.execute("""
+            UPDATE tasks SET
+                status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                lease_until = NULL,
+                error = ?
+            WHERE id = ?
+        """, (self.max_attempts, str(error), task_id))
+
+    def counts(self):
+        rows = self.connection.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        return dict(rows)
+
+    def has_open_tasks(self):
+        counts = self.counts()
+        return counts.get("queued", 0) + counts.get("leased", 0) > 0
+
+
+# Each broker step runs as one Lua script, so a worker dying between two commands can't lose a
+# task. KEYS: ready, leased, tasks, attempts, counts, failed, results
+REDIS_RECORD_FAILURE = """
+local function record_failure(task_id, task, error)
+    redis.call("HINCRBY", KEYS[5], "failed", 1)
+    redis.call("HDEL", KEYS[3], task_id)
+    local attempts = redis.call("HGET", KEYS[4], task_id) or "0"
+    redis.call("HDEL", KEYS[4], task_id)
+    redis.call("RPUSH", KEYS[6], '{"task": ' .. task .. ', "attempts": ' .. attempts .. ', "error": ' .. cjson.encode(error) .. '}')
+end
+"""
+
+# ARGV: now, max_attempts
+REDIS_REQUEUE_EXPIRED = REDIS_RECORD_FAILURE + """
+for _, task_id in ipairs(redis.call("ZRANGEBYSCORE", KEYS[2], 0, ARGV[1])) do
+    redis.call("ZREM", KEYS[2], task_id)
+    local task = redis.call("HGET", KEYS[3], task_id)
+    if task then
+        -- A task that keeps outliving its lease keeps crashing its worker; stop handing it out
+        if tonumber(redis.call("HGET", KEYS[4], task_id) or "0") >= tonumber(ARGV[2]) then
+            record_failure(task_id, task, "lease expired")
+        else
+            redis.call("ZADD", KEYS[1], cjson.decode(task)["priority"], task_id)
+        end
+    end
+end
+"""
+
+# ARGV: lease_until
+REDIS_LEASE = """
+while true do
+    local popped = redis.call("ZPOPMIN", KEYS[1])
+    if #popped == 0 then
+        return nil
+    end
+    local task_id = popped[1]
+    local task = redis.call("HGET", KEYS[3], task_id)
+    if task then
+        redis.call("ZADD", KEYS[2], ARGV[1], task_id)
+        return {task_id, task, redis.call("HINCRBY", KEYS[4], task_id, 1)}
+    end
+end
+"""
+
+# ARGV: task_id, result
+REDIS_COMPLETE = """
+redis.call("ZREM", KEYS[2], ARGV[1])
+-- Another worker may have finished a redelivered copy already
+if redis.call("HDEL", KEYS[3], ARGV[1]) == 1 then
+    redis.call("HDEL", KEYS[4], ARGV[1])
+    redis.call("HINCRBY", KEYS[5], "done", 1)
+    redis.call("RPUSH", KEYS[7], ARGV[2])
+end
+"""
+
+# ARGV: task_id, max_attempts, error
+REDIS_FAIL = REDIS_RECORD_FAILURE + """
+redis.call("ZREM", KEYS[2], ARGV[1])
+local task = redis.call("HGET", KEYS[3], ARGV[1])
+if not task then
+    return
+end
+if tonumber(redis.call("HGET", KEYS[4], ARGV[1]) or "0") >= tonumber(ARGV[2]) then
+    record_failure(ARGV[1], task, ARGV[3])
+else
+    redis.call("ZADD", KEYS[1], cjson.decode(task)["priority"], ARGV[1])
+end
+"""
+
+
+class RedisTaskQueue:
+
+    def __init__(self, redis_url="redis://localhost:6379/0", prefix="is24", visibility_timeout=300, max_attempts=3):
+        try:
+            import redis
+        except ImportError:
+            raise Exception("RedisTaskQueue requires the redis package")
+        self.client = redis.Redis.from_url(redis_url)
+        self.prefix = prefix
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.keys = [self.key(name) for name in ("ready", "leased", "tasks", "attempts", "counts", "failed", "results")]
+        self.requeue_script = self.client.register_script(REDIS_REQUEUE_EXPIRED)
+        self.lease_script = self.client.register_script(REDIS_LEASE)
+        self.complete_script = self.client.register_script(REDIS_COMPLETE)
+        self.fail_script = self.client.register_script(REDIS_FAIL)
+
+    def key(self, name):
+        return f"{self.prefix}:{name}"
+
+    def put(self, stage, payload, dedup_key=None, priority=None):
+        if priority is None:
+            priority = STAGE_PRIORITIES[stage]
+        if dedup_key and not self.client.sadd(self.key("seen"), dedup_key):
+            return False
+        task_id = str(self.client.incr(self.key("next_id")))
+        task = {"id": task_id, "stage": stage, "payload": payload, "priority": priority}
+        pipeline = self.client.pipeline()
+        pipeline.hset(self.key("tasks"), task_id, json.dumps(task))
+        pipeline.zadd(self.key("ready"), {task_id: priority})
+        pipeline.execute()
+        return True
+
+    def requeue_expired(self):
+        self.requeue_script(keys=self.keys, args=[time.time(), self.max_attempts])
+
+    def lease(self, worker_id):
+        self.requeue_expired()
+        leased = self.lease_script(keys=self.keys, args=[time.time() + self.visibility_timeout])
+        if not leased:
+            return None
+        task_id, task, attempts = leased
+        task = json.loads(task)
+        task["attempts"] = int(attempts)
+        task["worker_id"] = worker_id
+        return task
+
+    def complete(self, task_id, result=None):
+        self.complete_script(keys=self.keys, args=[task_id, json.dumps({"id": task_id, "result": result})])
+
+    def fail(self, task_id, error):
+        self.fail_script(keys=self.keys, args=[task_id, self.max_attempts, str(error)])
+
+    def counts(self):
+        counts = {key.decode(): int(value) for key, value in self.client.hgetall(self.key("counts")).items()}
+        counts["queued"] = self.client.zcard(self.key("ready"))
+        counts["leased"] = self.client.zcard(self.key("leased"))
+        return counts
+
+    def has_open_tasks(self):
+        counts = self.counts()
+        return counts["queued"] + counts["leased"] > 0
+
+
+def open_task_queue(broker="crawl-queue.db", visibility_timeout=300, max_attempts=3):
+    if broker.startswith("redis://"):
+        return RedisTaskQueue(broker, visibility_timeout=visibility_timeout, max_attempts=max_attempts)
+    return SqliteTaskQueue(broker, visibility_timeout=visibility_timeout, max_attempts=max_attempts)
+
+
+def enqueue_crawl(task_queue, keyword_list, pages):
+    for keyword in keyword_list:
+        city = f"{keyword['state']}-{keyword['city']}"
+        for page_number in range(pages):
+            task_queue.put(
+                "search",
+                {"keyword": keyword, "page_number": page_number},
+                dedup_key=f"search:{city}:{page_number}"
+            )
+
+
+def run_task(task_queue, task, location, worker_id):
+    payload = task["payload"]
+    if task["stage"] == "search":
+        keyword = payload["keyword"]
+        listings = []
+        # Every worker keeps its own shard so processes never append to the same file; the worker ID
+        # may hold hyphens too, so "--" marks where the city ends
+        data_pipeline = DataPipeline(csv_filename=f"{keyword['state']}-{keyword['city']}--{worker_id}.csv")
+        try:
+            scrape_search_results(
+                keyword,
+                location,
+                payload["page_number"],
+                data_pipeline=data_pipeline,
+                retries=0,
+                on_listing=lambda search_data: listings.append(asdict(search_data))
+            )
+        finally:
+            data_pipeline.close_pipeline()
+        for listing in listings:
+            task_queue.put(
+                "detail",
+                {"row": {"name": listing["name"], "url": listing["url"]}},
+                dedup_key=f"detail:{listing['url']}"
+            )
+        return {"listings": len(listings)}
+    cost_data = process_listing(payload["row"], location, retries=0)
+    return asdict(cost_data)
+
+
+def run_worker(broker, location, visibility_timeout=300, max_attempts=3, idle_timeout=30, poll_interval=1, structured_logs=False):
+    worker_id = f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    if profiler.enabled:
+        profiler.report_filename = f"{profiler.report_filename}.{worker_id}"
+    if page_archive.enabled:
+        # Worker processes must not append to one archive file concurrently
+        page_archive.open(f"{page_archive.path}.{worker_id}")
+    if page_quarantine.enabled:
+        page_quarantine.open(f"{page_quarantine.path}.{worker_id}")
+    if price_history.enabled:
+        price_history.open(f"{price_history.path}.{worker_id}")
+    task_queue = open_task_queue(broker, visibility_timeout=visibility_timeout, max_attempts=max_attempts)
+    # Forked workers inherit the queue handler but not the listener thread behind it
+    log_listener = setup_logging(level=logging.getLogger().level, structured=structured_logs)
+    logger.info("Worker %s started on %s", worker_id, broker)
+    with profiler.attach_worker():
+        idle_since = time.time()
+        while True:
+            task = task_queue.lease(worker_id)
+            if task is None:
+                # Other workers may still produce detail tasks from their search pages
+                if not task_queue.has_open_tasks() and time.time() - idle_since > idle_timeout:
+                    break
+                time.sleep(poll_interval)
+                continue
+            idle_since = time.time()
+            try:
+                result = run_task(task_queue, task, location, worker_id)
+                task_queue.complete(task["id"], result)
+            except Exception as e:
+                # The page is already quarantined, another lease would only fetch it again
+                if isinstance(e, ParseError) and page_quarantine.enabled:
+                    task_queue.complete(task["id"], {"quarantined": str(e)})
+                    continue
+                logger.error("Task %s (%s) failed: %s", task["id"], task["stage"], e)
+                task_queue.fail(task["id"], e)
+    profiler.write_report(force=True)
+    logger.info("Worker %s finished: %s", worker_id, task_queue.counts())
+    page_archive.close()
+    page_quarantine.close()
+    price_history.close()
+    # Worker processes exit without running atexit hooks
+    atexit.unregister(log_listener.stop)
+    log_listener.stop()
+
+
+def start_workers(broker, location, workers=4, visibility_timeout=300, max_attempts=3, idle_timeout=30, structured_logs=False):
+    # Workers inherit the loaded config and the archive, history, profiler and hedging
+    # settings from this process, which only fork carries over (3.14 defaults to forkserver)
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(broker, location),
+            kwargs={
+                "visibility_timeout": visibility_timeout,
+                "max_attempts": max_attempts,
+                "idle_timeout": idle_timeout,
+                "structured_logs": structured_logs
+            }
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -0,0 +1,119 @@
+import re
+from dataclasses import dataclass
+
+NUMBER_PATTERN = re.compile(r"[^\d,]")
+
+
+class ParseError(Exception):
+    pass
+
+
+def parse_number(value):
+    # German notation: dots group thousands, a comma starts the decimals
+    digits = NUMBER_PATTERN.sub("", value or "").replace(",", ".")
+    try:
+        return float(digits)
+    except ValueError:
+        return None
+
+
+@dataclass(frozen=True)
+class FieldSpec:
+    name: str
+    tag: str
+    class_token: str = None
+    attrs: tuple = ()
+    within: tuple = None
+    nth: int = 0
+    child: str = None
+    attribute: str = None
+    remove: tuple = ()
+    strip: bool = False
+
+    def matches(self, element):
+        return element_matches(element, self.class_token, self.attrs)
+
+    def clean(self, value):
+        for text in self.remove:
+            value = value.replace(text, "")
+        return value.strip() if self.strip else value
+
+
+def element_matches(element, class_token=None, attrs=()):
+    if class_token and class_token not in (element.get("class") or ()):
+        return False
+    for name, value in attrs:
+        if element.get(name) != value:
+            return False
+    return True
+
+
+class ExtractionPlan:
+
+    def __init__(self, specs):
+        self.specs = tuple(specs)
+        # Specs are grouped by tag name once, so each element costs one dict lookup
+        self.by_tag = {}
+        for spec in self.specs:
+            self.by_tag.setdefault(spec.tag, []).append(spec)
+
+    def is_within(self, element, root, within):
+        tag, class_token, attrs = within
+        parent = element.parent
+        while parent is not None and parent is not root:
+            if parent.name == tag and element_matches(parent, class_token, attrs):
+                return True
+            parent = parent.parent
+        return False
+
+    def extract(self, root):
+        values = {}
+        counts = {}
+        for element in root.descendants:
+            specs = self.by_tag.get(element.name)
+            if not specs:
+                continue
+            for spec in specs:
+                if spec.name in values or not spec.matches(element):
+                    continue
+                if spec.within and not self.is_within(element, root, spec.within):
+                    continue
+                seen = counts.get(spec.name, 0)
+                counts[spec.name] = seen + 1
+                if seen != spec.nth:
+                    continue
+                target = element.find(spec.child) if spec.child else element
+                if target is None:
+                    continue
+                value = target.get(spec.attribute) if spec.attribute else target.get_text()
+                if value is not None:
+                    values[spec.name] = spec.clean(value)
+            if len(values) == len(self.specs):
+                break
+        return values
+
+    def extract_all(self, root):
+        values = self.extract(root)
+        if len(values) < len(self.specs):
+            missing = [spec.name for spec in self.specs if spec.name not in values]
+            raise ParseError(f"Missing fields: {', '.join(missing)}")
+        return values
+
+
+SEARCH_ATTRIBUTES = ("div", None, (("data-is24-qa", "attributes"),))
+
+SEARCH_CARD_PLAN = ExtractionPlan([
+    FieldSpec("name", "div", class_token="result-list-entry__address"),
+    FieldSpec("href", "a", attribute="href"),
+    FieldSpec("price", "dl", within=SEARCH_ATTRIBUTES, nth=0, remove=("Kaltmiete",)),
+    FieldSpec("size", "dl", within=SEARCH_ATTRIBUTES, nth=1, remove=("Wohnfläche",)),
+    FieldSpec("date_text", "dl", within=SEARCH_ATTRIBUTES, nth=2, child="dd"),
+])
+
+DETAIL_PLAN = ExtractionPlan([
+    FieldSpec("cold_rent", "dd", class_token="is24qa-kaltmiete", strip=True),
+    FieldSpec("price_per_m2", "dd", class_token="is24qa-preism²", remove=("Kalkuliert von ImmoScout24",), strip=True),
+    FieldSpec("additional_costs", "dd", class_token="is24qa-nebenkosten", strip=True),
+    FieldSpec("heating_costs", "dd", class_token="is24qa-heizkosten", strip=True),
+    FieldSpec("total_cost", "dd", class_token="is24qa-gesamtmiete", strip=True),
+])
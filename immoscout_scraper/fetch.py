@@ -0,0 +1,273 @@
+import re
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+from .archive import page_archive
+from .proxy import STAGE_FETCH_MODES, get_scrapeops_url, request_credits
+from .credits import credit_ledger, BudgetExhausted
+from .routing import proxy_router, PROVIDER_FAILURE_STATUSES
+from .metrics import metrics
+from .profiling import profiler
+from .logs import HOT_LOOP
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 180
+
+_session = None
+_session_lock = threading.Lock()
+
+# Bytes every usable page of a stage contains, checked before anything is decoded or parsed
+STAGE_MARKERS = {
+    "search": b"result-list-entry__data",
+    "detail": b"is24qa-kaltmiete",
+}
+
+
+def url_pattern(url):
+    return re.sub(r"\d+", "{n}", urlparse(url).path)
+
+
+class FetchModeMemory:
+
+    def __init__(self, probe_interval=50):
+        self.probe_interval = probe_interval
+        self.modes = {}
+        self.lock = threading.Lock()
+
+    def first_mode(self, stage, url):
+        modes = STAGE_FETCH_MODES[stage]
+        key = (stage, url_pattern(url))
+        with self.lock:
+            entry = self.modes.get(key)
+            if entry is None:
+                return 0
+            entry["uses"] += 1
+            # Pages that needed escalation get a cheap probe now and then in case that changed
+            if entry["index"] > 0 and entry["uses"] % self.probe_interval == 0:
+                return 0
+            return min(entry["index"], len(modes) - 1)
+
+    def remember(self, stage, url, index):
+        with self.lock:
+            entry = self.modes.setdefault((stage, url_pattern(url)), {"index": index, "uses": 0})
+            entry["index"] = index
+
+
+fetch_modes = FetchModeMemory()
+
+
+class HedgePolicy:
+
+    def __init__(self, enabled=False, quantile=0.95, max_ratio=0.05, min_samples=20, window=500):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.window = window
+        self.latencies = {}
+        self.requests = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def configure(self, enabled=True, quantile=None, max_ratio=None):
+        self.enabled = enabled
+        if quantile is not None:
+            self.quantile = quantile
+        if max_ratio is not None:
+            self.max_ratio = max_ratio
+
+    def record(self, key, seconds):
+        with self.lock:
+            latencies = self.latencies.get(key)
+            if latencies is None:
+                latencies = self.latencies[key] = deque(maxlen=self.window)
+            latencies.append(seconds)
+
+    def hedge_delay(self, key):
+        with self.lock:
+            self.requests += 1
+            latencies = self.latencies.get(key)
+            if not self.enabled or latencies is None or len(latencies) < self.min_samples:
+                return None
+            ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+
+    def try_hedge(self):
+        # Duplicates are capped at a fixed share of all requests so hedging can't snowball
+        with self.lock:
+            if self.hedges + 1 > self.max_ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+
+hedging = HedgePolicy()
+
+
+def http_session():
+    global _session
+    if _session is None:
+        import requests
+
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Connections to the proxies stay open between pages, workers and hedges
+                adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=64)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def timed_get(proxy_url, key, stream=False, headers=None, city=None, credits=0):
+    # The caller reserved the credits; only a request that got an answer is billed
+    start_time = time.perf_counter()
+    try:
+        response = http_session().get(proxy_url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=stream, headers=headers)
+    except Exception:
+        credit_ledger.release(credits)
+        raise
+    elapsed = time.perf_counter() - start_time
+    credit_ledger.charge(key[0], city, credits, pages=0, reserved=credits)
+    hedging.record(key, elapsed)
+    metrics.observe("fetch_seconds", elapsed, stage=key[0], mode=key[1])
+    return response
+
+
+def start_request(proxy_url, key, stream=False, headers=None, city=None, credits=0):
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(timed_get(proxy_url, key, stream=stream, headers=headers, city=city, credits=credits))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+def hedged_get(proxy_url, key, stream=False, headers=None, city=None, credits=0):
+    delay = hedging.hedge_delay(key)
+    if delay is None:
+        return timed_get(proxy_url, key, stream=stream, headers=headers, city=city, credits=credits)
+    primary = start_request(proxy_url, key, stream=stream, headers=headers, city=city, credits=credits)
+    done, _ = wait([primary], timeout=delay)
+    if done or not hedging.try_hedge():
+        return primary.result()
+    # The duplicate is billed like any other request, so it has to fit the budget too
+    if not credit_ledger.reserve(credits):
+        metrics.inc("budget_skipped_total", stage="hedge")
+        return primary.result()
+    hedge = start_request(proxy_url, key, stream=stream, headers=headers, city=city, credits=credits)
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                metrics.inc("hedges_total", stage=key[0], winner="hedge" if future is hedge else "primary")
+                # The loser holds a pooled connection until its response is closed, now or once it arrives
+                loser = primary if future is hedge else hedge
+                loser.add_done_callback(close_response)
+                return future.result()
+    return primary.result()
+
+
+def routed_get(url, location, stage, mode, stream=False, headers=None, city=None):
+    response = None
+    error = None
+    credits = request_credits(mode)
+    for provider in proxy_router.route():
+        # Every attempt, failovers included, has to fit the budget before it is sent
+        if not credit_ledger.reserve(credits):
+            raise BudgetExhausted(f"Credit budget spent, {mode} {stage} fetch of {url} needs {credits}")
+        proxy_url = get_scrapeops_url(url, location=location, stage=stage, mode=mode, provider=provider)
+        if headers:
+            # The proxy drops request headers unless told to pass them on to the site
+            proxy_url = f"{proxy_url}&keep_headers=true"
+        start_time = time.perf_counter()
+        try:
+            response = hedged_get(proxy_url, (stage, mode), stream=stream, headers=headers, city=city, credits=credits)
+        except Exception as e:
+            proxy_router.record(provider, time.perf_counter() - start_time, ok=False)
+            logger.warning("Proxy %s failed for %s: %s", provider.name, url, e, extra=HOT_LOOP)
+            error = e
+            continue
+        ok = response.status_code not in PROVIDER_FAILURE_STATUSES
+        proxy_router.record(provider, time.perf_counter() - start_time, ok=ok)
+        if ok:
+            return response
+        logger.warning("Proxy %s answered %s for %s", provider.name, response.status_code, url, extra=HOT_LOOP)
+    # Every provider failed; the last answer, if any, goes back to the caller's retry logic
+    if response is None:
+        raise error
+    return response
+
+
+def page_is_complete(stage, response):
+    marker = STAGE_MARKERS.get(stage)
+    return response.status_code == 200 and (marker is None or marker in response.content)
+
+
+def conditional_headers(etag=None, last_modified=None):
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers or None
+
+
+def fetch_page(url, location="us", stage="search", extract=None, meta=None, headers=None, city=None):
+    # With an extract callback the body is streamed into it and its result decides completeness
+    stream = extract is not None
+    modes = STAGE_FETCH_MODES[stage]
+    response = None
+    with profiler.stage(url, "fetch"):
+        first = fetch_modes.first_mode(stage, url)
+        for index in range(first, len(modes)):
+            mode = modes[index]
+            response = routed_get(url, location, stage, mode, stream=stream, headers=headers, city=city)
+            # Requests bill themselves; escalations and hedges fetch the same page again
+            if index == first:
+                credit_ledger.count_page(stage)
+            metrics.inc("requests_total", stage=stage, status=response.status_code)
+            if response.status_code == 304:
+                response.extracted = None
+                response.close()
+                return response
+            # Only a page that arrived without its content is worth a dearer mode; a 404 or a
+            # site error goes back to the caller's retry logic
+            if response.status_code != 200:
+                response.extracted = None
+                return response
+            if stream:
+                start_time = time.perf_counter()
+                with profiler.stage(url, "parse"):
+                    response.extracted = extract(response)
+                metrics.observe("parse_seconds", time.perf_counter() - start_time, stage=stage)
+                complete = response.extracted is not None
+            else:
+                complete = page_is_complete(stage, response)
+            if complete:
+                metrics.inc("fetch_mode_total", stage=stage, mode=mode, outcome="complete")
+                fetch_modes.remember(stage, url, index)
+                if page_archive.enabled:
+                    body = getattr(response, "raw_body", None) if stream else response.content
+                    page_archive.record(url, stage, body, meta=meta)
+                return response
+            metrics.inc("fetch_mode_total", stage=stage, mode=mode, outcome="escalated")
+            logger.debug("%s fetch of %s incomplete, escalating", mode, url)
+    return response
@@ -0,0 +1,198 @@
+import os
+import mmap
+import time
+import struct
+import logging
+import threading
+from datetime import datetime
+
+from .dedup import expose_id
+from .extract import parse_number
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+HISTORY_FIELDS = ("price", "total_cost")
+# One fixed-width file per column; a row is one change of one field of one listing
+COLUMNS = (("ids", "Q"), ("times", "I"), ("fields", "B"), ("deltas", "q"))
+
+
+class Column:
+
+    def __init__(self, path, typecode):
+        self.path = path
+        self.typecode = typecode
+        self.itemsize = struct.calcsize(typecode)
+        self.file = open(path, "a+b")
+        self.length = self.file.tell() // self.itemsize
+        self.map = None
+        self.view = None
+
+    def append(self, value):
+        self.file.write(struct.pack(self.typecode, value))
+        self.length += 1
+
+    def truncate(self, length):
+        self.release()
+        self.file.truncate(length * self.itemsize)
+        self.file.seek(0, os.SEEK_END)
+        self.length = length
+
+    def values(self):
+        if self.length == 0:
+            return ()
+        if self.view is None or len(self.view) != self.length:
+            self.file.flush()
+            self.release()
+            # Readers index straight into the page cache, nothing is parsed or copied up front
+            self.map = mmap.mmap(self.file.fileno(), self.length * self.itemsize, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map).cast(self.typecode)
+        return self.view
+
+    def release(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def close(self):
+        self.release()
+        self.file.close()
+
+
+class PriceHistory:
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.lock = threading.Lock()
+        self.columns = {name: Column(os.path.join(path, f"{name}.bin"), typecode) for name, typecode in COLUMNS}
+        # A crash between column appends leaves them uneven; the partial row is dropped
+        length = min(column.length for column in self.columns.values())
+        for column in self.columns.values():
+            if column.length != length:
+                column.truncate(length)
+        self.positions = {}
+        self.latest = {}
+        ids, fields, deltas = (self.columns[name].values() for name in ("ids", "fields", "deltas"))
+        for position in range(length):
+            key = (ids[position], fields[position])
+            self.positions.setdefault(ids[position], []).append(position)
+            self.latest[key] = self.latest.get(key, 0) + deltas[position]
+
+    def __len__(self):
+        return self.columns["ids"].length
+
+    def record(self, listing_id, field, value, timestamp=None):
+        field_index = HISTORY_FIELDS.index(field)
+        cents = round(value * 100)
+        listing_id = int(listing_id)
+        key = (listing_id, field_index)
+        with self.lock:
+            previous = self.latest.get(key)
+            # Only changes are stored, so a price that holds for a year is still one row
+            if previous == cents:
+                return False
+            position = len(self)
+            self.columns["ids"].append(listing_id)
+            self.columns["times"].append(int(timestamp or time.time()))
+            self.columns["fields"].append(field_index)
+            self.columns["deltas"].append(cents - (previous or 0))
+            self.latest[key] = cents
+            self.positions.setdefault(listing_id, []).append(position)
+        metrics.inc("price_changes_total", field=field)
+        return True
+
+    def history(self, listing_id, field=None):
+        listing_id = int(listing_id)
+        with self.lock:
+            times, fields, deltas = (self.columns[name].values() for name in ("times", "fields", "deltas"))
+            values = {}
+            changes = []
+            for position in self.positions.get(listing_id, ()):
+                field_index = fields[position]
+                values[field_index] = values.get(field_index, 0) + deltas[position]
+                if field is None or HISTORY_FIELDS[field_index] == field:
+                    changes.append({
+                        "time": times[position],
+                        "field": HISTORY_FIELDS[field_index],
+                        "value": values[field_index] / 100,
+                    })
+        return changes
+
+    def drops_since(self, since, field="price"):
+        field_index = HISTORY_FIELDS.index(field)
+        with self.lock:
+            times, fields, deltas = (self.columns[name].values() for name in ("times", "fields", "deltas"))
+            drops = []
+            for listing_id, positions in self.positions.items():
+                now = self.latest.get((listing_id, field_index))
+                if now is None:
+                    continue
+                # Walk back from the latest value, undoing only the changes made after `since`
+                before = now
+                known_then = False
+                for position in reversed(positions):
+                    if fields[position] != field_index:
+                        continue
+                    if times[position] <= since:
+                        known_then = True
+                        break
+                    before -= deltas[position]
+                if known_then and now < before:
+                    drops.append({
+                        "expose_id": str(listing_id),
+                        "before": before / 100,
+                        "now": now / 100,
+                        "drop": (before - now) / 100,
+                    })
+        drops.sort(key=lambda drop: -drop["drop"])
+        return drops
+
+    def flush(self):
+        with self.lock:
+            for column in self.columns.values():
+                column.file.flush()
+
+    def close(self):
+        with self.lock:
+            for column in self.columns.values():
+                column.close()
+
+
+class HistoryRecorder:
+
+    def __init__(self):
+        self.store = None
+        self.path = None
+
+    @property
+    def enabled(self):
+        return self.store is not None
+
+    def open(self, path):
+        self.close()
+        self.path = path
+        self.store = PriceHistory(path)
+
+    def record(self, url, field, text):
+        if self.store is None:
+            return
+        listing_id = expose_id(url)
+        value = parse_number(text)
+        if listing_id and value is not None:
+            self.store.record(listing_id, field, value)
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+
+price_history = HistoryRecorder()
+
+
+def parse_since(value):
+    return int(datetime.fromisoformat(value).timestamp())
@@ -0,0 +1,121 @@
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
+
+
+# Passed as extra= by the hot-loop call sites (duplicates, retries, per-request status);
+# every other message is always logged
+HOT_LOOP = {"hot_loop": True}
+
+
+class RateLimitFilter(logging.Filter):
+
+    def __init__(self, burst=10, interval=10.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.CRITICAL or not getattr(record, "hot_loop", False):
+            return True
+        # Messages are logged lazily, so the unformatted template identifies repeats
+        key = (record.name, record.msg)
+        now = record.created
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self.windows[key] = [now, 1, 0, record.levelno]
+            elif window[1] < self.burst:
+                window[1] += 1
+                return True
+            else:
+                window[2] += 1
+                return False
+        # The count rides on the record rather than the template, which may hold a literal %
+        record.suppressed = suppressed
+        return True
+
+    def pending(self):
+        # Counts no later message of the same template picked up
+        with self.lock:
+            windows, self.windows = self.windows, {}
+        for (name, msg), (_, _, suppressed, levelno) in windows.items():
+            if suppressed:
+                yield logging.LogRecord(
+                    name, levelno, "", 0, "%s similar messages suppressed: %s", (suppressed, msg), None
+                )
+
+
+class TextFormatter(logging.Formatter):
+
+    def format(self, record):
+        message = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            message = f"{message} ({suppressed} similar messages suppressed)"
+        return message
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+
+    def prepare(self, record):
+        # The listener lives in this process, so formatting can wait until it runs
+        return record
+
+
+class RateLimitedQueueListener(logging.handlers.QueueListener):
+
+    def __init__(self, log_queue, handler, rate_limit):
+        super().__init__(log_queue, handler)
+        self.rate_limit = rate_limit
+
+    def stop(self):
+        if self._thread is None:
+            return
+        super().stop()
+        for record in self.rate_limit.pending():
+            self.handle(record)
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(level=logging.INFO, structured=False, burst=10, interval=10.0):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    stream_handler = logging.StreamHandler()
+    if structured:
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(TextFormatter(logging.BASIC_FORMAT))
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    rate_limit = RateLimitFilter(burst=burst, interval=interval)
+    queue_handler.addFilter(rate_limit)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    listener = RateLimitedQueueListener(log_queue, stream_handler, rate_limit)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,50 @@
+from dataclasses import dataclass, fields
+
+
+@dataclass
+class SearchData:
+    name: str = ""
+    price: str = ""
+    size: str = ""
+    date_available: str = ""
+    url: str = ""
+
+    def __post_init__(self):
+        self.check_string_fields()
+        
+    def check_string_fields(self):
+        for field in fields(self):
+            # Check string fields
+            if isinstance(getattr(self, field.name), str):
+                # If empty set default text
+                if getattr(self, field.name) == "":
+                    setattr(self, field.name, f"No {field.name}")
+                    continue
+                # Strip any trailing spaces, etc.
+                value = getattr(self, field.name)
+                setattr(self, field.name, value.strip())
+
+@dataclass
+class CostData:
+    name: str = ""
+    cold_rent: str = ""
+    price_per_m2: str = ""
+    additional_costs: str = ""
+    total_cost: str = ""
+    url: str = ""
+
+
+    def __post_init__(self):
+        self.check_string_fields()
+        
+    def check_string_fields(self):
+        for field in fields(self):
+            # Check string fields
+            if isinstance(getattr(self, field.name), str):
+                # If empty set default text
+                if getattr(self, field.name) == "":
+                    setattr(self, field.name, f"No {field.name}")
+                    continue
+                # Strip any trailing spaces, etc.
+                value = getattr(self, field.name)
+                setattr(self, field.name, value.strip())
@@ -0,0 +1,117 @@
+import re
+import random
+import hashlib
+import logging
+import threading
+
+from .extract import parse_number
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MERSENNE_PRIME = (1 << 61) - 1
+NUM_PERM = 64
+BANDS = 16
+# Price and size tokens are repeated so the same building's other flats don't read as the same flat
+FIELD_WEIGHT = 6
+
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+STREET_PATTERN = re.compile(r"(strasse|str\b\.?)")
+NON_ALNUM_PATTERN = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_text(value):
+    value = (value or "").lower().translate(UMLAUTS)
+    value = STREET_PATTERN.sub("str", value)
+    return NON_ALNUM_PATTERN.sub(" ", value).strip()
+
+
+def normalize_number(value):
+    number = parse_number(value)
+    return str(round(number)) if number is not None else ""
+
+
+def listing_features(name, price, size, date_available=""):
+    address = normalize_text(name)
+    features = {address[i:i + 3] for i in range(max(len(address) - 2, 1))}
+    for field_name, value in (("price", normalize_number(price)), ("size", normalize_number(size))):
+        features.update(f"{field_name}:{value}#{copy}" for copy in range(FIELD_WEIGHT))
+    features.add(f"date:{normalize_text(date_available)}")
+    return features
+
+
+class MinHasher:
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = random.Random(seed)
+        self.permutations = [
+            (rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_perm)
+        ]
+
+    def signature(self, features):
+        hashes = [
+            int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            for feature in features
+        ]
+        return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self.permutations)
+
+
+class NearDuplicateIndex:
+
+    def __init__(self, threshold=0.75, num_perm=NUM_PERM, bands=BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self.signatures = {}
+        self.buckets = [{} for _ in range(bands)]
+        self.clusters = {}
+        self.lock = threading.Lock()
+
+    def band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows] for band in range(len(self.buckets))]
+
+    def similarity(self, first, second):
+        return sum(1 for a, b in zip(first, second) if a == b) / len(first)
+
+    def add(self, key, features):
+        # Seeing the same listing again is for exact dedup to judge, it is no repost of itself
+        if key in self.signatures:
+            return None
+        signature = self.hasher.signature(features)
+        band_keys = self.band_keys(signature)
+        with self.lock:
+            # Only listings sharing a whole band are compared, so a lookup never scans the index
+            candidates = set()
+            for buckets, band_key in zip(self.buckets, band_keys):
+                candidates.update(buckets.get(band_key, ()))
+            best, best_similarity = None, self.threshold
+            for candidate in candidates:
+                similarity = self.similarity(signature, self.signatures[candidate])
+                if similarity >= best_similarity:
+                    best, best_similarity = candidate, similarity
+            if best is not None:
+                self.clusters.setdefault(best, []).append(key)
+                return best
+            self.signatures[key] = signature
+            for buckets, band_key in zip(self.buckets, band_keys):
+                buckets.setdefault(band_key, []).append(key)
+        return None
+
+    def add_listing(self, key, name, price, size, date_available=""):
+        representative = self.add(key, listing_features(name, price, size, date_available))
+        if representative is not None:
+            logger.info("%s looks like a repost of %s, collapsed", key, representative)
+        return representative
+
+
+def collapse_rows(rows, index):
+    for row in rows:
+        representative = index.add_listing(
+            row["url"], row["name"], row.get("price"), row.get("size"), row.get("date_available")
+        )
+        if representative is not None:
+            metrics.inc("detail_skipped_total", reason="near_duplicate")
+            continue
+        yield row
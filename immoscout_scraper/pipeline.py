@@ -0,0 +1,137 @@
+import os
+import csv
+import time
+import logging
+from dataclasses import fields, asdict
+
+from .dedup import expose_id, card_fingerprint
+from .writers import ShardWriter
+from .metrics import metrics
+from .profiling import profiler
+from .logs import HOT_LOOP
+
+logger = logging.getLogger(__name__)
+
+
+class DataPipeline:
+    
+    def __init__(self, csv_filename="", storage_queue_limit=50, seen_index=None, compression=None,
+                 rotate_bytes=None, rotate_seconds=None, jsonl_sink=None, write_csv=True, near_duplicates=None):
+        self.names_seen = set()
+        self.seen_index = seen_index
+        self.near_duplicates = near_duplicates
+        self.storage_queue = []
+        self.storage_queue_limit = storage_queue_limit
+        self.csv_filename = csv_filename
+        self.csv_file_open = False
+        self.jsonl_sink = jsonl_sink
+        self.write_csv = write_csv
+        self.shard_writer = None
+        if write_csv and (compression or rotate_bytes or rotate_seconds):
+            self.shard_writer = ShardWriter(
+                csv_filename,
+                compression=compression,
+                rotate_bytes=rotate_bytes,
+                rotate_seconds=rotate_seconds
+            )
+
+    @property
+    def output_files(self):
+        if not self.write_csv:
+            return []
+        if self.shard_writer is not None:
+            return list(self.shard_writer.output_files)
+        return [self.csv_filename]
+    
+    def save_to_csv(self):
+        data_to_save = []
+        data_to_save.extend(self.storage_queue)
+        self.storage_queue.clear()
+        if not data_to_save:
+            return
+        self.csv_file_open = True
+        metrics.gauge_add("pipeline_queue_depth", -len(data_to_save))
+        start_time = time.perf_counter()
+
+        if self.jsonl_sink is not None:
+            self.jsonl_sink.write_records(data_to_save)
+        if not self.write_csv:
+            metrics.observe("pipeline_flush_seconds", time.perf_counter() - start_time)
+            metrics.inc("pipeline_records_written_total", len(data_to_save))
+            self.csv_file_open = False
+            return
+
+        keys = [field.name for field in fields(data_to_save[0])]
+        if self.shard_writer is not None:
+            self.shard_writer.write_rows(keys, [asdict(item) for item in data_to_save])
+            metrics.observe("pipeline_flush_seconds", time.perf_counter() - start_time)
+            metrics.inc("pipeline_records_written_total", len(data_to_save))
+            self.csv_file_open = False
+            return
+
+        file_exists = os.path.isfile(self.csv_filename) and os.path.getsize(self.csv_filename) > 0
+        with open(self.csv_filename, mode="a", newline="", encoding="utf-8") as output_file:
+            writer = csv.DictWriter(output_file, fieldnames=keys)
+
+            if not file_exists:
+                writer.writeheader()
+
+            for item in data_to_save:
+                writer.writerow(asdict(item))
+
+        metrics.observe("pipeline_flush_seconds", time.perf_counter() - start_time)
+        metrics.inc("pipeline_records_written_total", len(data_to_save))
+        self.csv_file_open = False
+                    
+    def is_duplicate(self, input_data):
+        if input_data.name in self.names_seen:
+            logger.warning("Duplicate item found: %s. Item dropped.", input_data.name, extra=HOT_LOOP)
+            metrics.inc("dedup_drops_total", record=type(input_data).__name__, source="run")
+            return "run"
+        self.names_seen.add(input_data.name)
+        listing_id = expose_id(getattr(input_data, "url", None))
+        # Every card enters the near-duplicate index before the seen index can drop it, so a
+        # cluster's representative from an earlier run still catches its reposts
+        if self.near_duplicates is not None and hasattr(input_data, "size"):
+            representative = self.near_duplicates.add_listing(
+                input_data.url,
+                input_data.name,
+                input_data.price,
+                input_data.size,
+                input_data.date_available
+            )
+            if representative is not None:
+                metrics.inc("dedup_drops_total", record=type(input_data).__name__, source="near")
+                return "near"
+        if self.seen_index is not None and listing_id and self.seen_index.check_and_add(listing_id):
+            # A listing whose detail never arrived, or whose card changed since, is stored again,
+            # so a failed detail stage or a price change isn't lost
+            state = self.seen_index.detail_state(listing_id)
+            card = {"price": getattr(input_data, "price", ""), "size": getattr(input_data, "size", "")}
+            if state is not None and state["card_fingerprint"] == card_fingerprint(card):
+                logger.info("Listing %s already known from an earlier crawl. Item dropped.", listing_id, extra=HOT_LOOP)
+                metrics.inc("dedup_drops_total", record=type(input_data).__name__, source="index")
+                return "index"
+        return None
+            
+    def add_data(self, scraped_data):
+        return self.add_record(scraped_data) is None
+
+    def add_record(self, scraped_data):
+        # Returns why the item was dropped ("run", "index" or "near"), or None once it is queued
+        duplicate = self.is_duplicate(scraped_data)
+        if duplicate is None:
+            self.storage_queue.append(scraped_data)
+            metrics.gauge_add("pipeline_queue_depth", 1)
+            if len(self.storage_queue) >= self.storage_queue_limit and self.csv_file_open == False:
+                self.save_to_csv()
+        return duplicate
+                       
+    def close_pipeline(self):
+        if self.csv_file_open:
+            time.sleep(3)
+        if len(self.storage_queue) > 0:
+            self.save_to_csv()
+        if self.shard_writer is not None:
+            self.shard_writer.close()
+        profiler.write_report()
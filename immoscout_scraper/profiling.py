@@ -0,0 +1,149 @@
+import io
+import os
+import sys
+import time
+import pstats
+import logging
+import cProfile
+import threading
+from contextlib import contextmanager
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+PROFILE_STAGES = ("fetch", "decode", "parse", "extract", "store")
+
+
+class Profiler:
+
+    def __init__(self):
+        self.enabled = False
+        self.report_filename = "profile-report.txt"
+        self.top_n = 20
+        self.mode = None
+        self.report_interval = 10
+        self.last_report = 0
+        self.timings = {}
+        self.worker_stats = []
+        self.samples = Counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def enable(self, report_filename="profile-report.txt", top_n=20, mode=None, report_interval=10):
+        self.enabled = True
+        self.report_filename = report_filename
+        self.top_n = top_n
+        # From Python 3.12 only one cProfile.Profile can be active per process, not one per thread
+        if mode == "cprofile" and sys.version_info >= (3, 12):
+            logger.warning("cProfile can't profile worker threads separately on Python 3.12+, sampling instead")
+            mode = "sampling"
+        self.mode = mode
+        self.report_interval = report_interval
+
+    @contextmanager
+    def stage(self, url, stage_name):
+        if not self.enabled or url is None:
+            yield
+            return
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        # Time spent in nested stages is only counted once, in the innermost stage
+        stack.append(0.0)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self.lock:
+                url_timings = self.timings.setdefault(url, dict.fromkeys(PROFILE_STAGES, 0.0))
+                url_timings[stage_name] += elapsed - nested
+
+    @contextmanager
+    def attach_worker(self):
+        if not self.enabled or self.mode is None:
+            yield
+            return
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                with self.lock:
+                    self.worker_stats.append(profile)
+            return
+        stop_event = threading.Event()
+        thread_id = threading.get_ident()
+        sampler = threading.Thread(target=self.sample_thread, args=(thread_id, stop_event), daemon=True)
+        sampler.start()
+        try:
+            yield
+        finally:
+            stop_event.set()
+            sampler.join()
+
+    def sample_thread(self, thread_id, stop_event, interval=0.005):
+        while not stop_event.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            code = frame.f_code
+            with self.lock:
+                self.samples[f"{code.co_filename}:{frame.f_lineno} {code.co_name}"] += 1
+
+    def percentile(self, values, percent):
+        if not values:
+            return 0.0
+        values = sorted(values)
+        index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+        return values[index]
+
+    def render_report(self):
+        with self.lock:
+            timings = {url: dict(stages) for url, stages in self.timings.items()}
+            worker_stats = list(self.worker_stats)
+            samples = self.samples.most_common(self.top_n)
+        lines = [f"Profiled URLs: {len(timings)}", "", "Stage percentiles (seconds)"]
+        lines.append(f"{'stage':<10}{'p50':>10}{'p90':>10}{'p99':>10}{'total':>12}")
+        for stage_name in PROFILE_STAGES:
+            values = [stages[stage_name] for stages in timings.values()]
+            lines.append(
+                f"{stage_name:<10}{self.percentile(values, 50):>10.4f}{self.percentile(values, 90):>10.4f}"
+                f"{self.percentile(values, 99):>10.4f}{sum(values):>12.4f}"
+            )
+        lines += ["", f"Top {self.top_n} slowest URLs (seconds)"]
+        slowest = sorted(timings.items(), key=lambda item: sum(item[1].values()), reverse=True)[:self.top_n]
+        for url, stages in slowest:
+            breakdown = " ".join(f"{name}={stages[name]:.4f}" for name in PROFILE_STAGES)
+            lines.append(f"{sum(stages.values()):.4f} {url} {breakdown}")
+        if worker_stats:
+            stream = io.StringIO()
+            stats = pstats.Stats(worker_stats[0], stream=stream)
+            for profile in worker_stats[1:]:
+                stats.add(profile)
+            stats.sort_stats("cumulative").print_stats(self.top_n)
+            lines += ["", "cProfile (all workers)", stream.getvalue().rstrip()]
+        if samples:
+            lines += ["", "Sampled hot frames"]
+            lines += [f"{count:>8} {location}" for location, count in samples]
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, force=False):
+        if not self.enabled:
+            return
+        now = time.time()
+        if not force and now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        report = self.render_report()
+        with open(f"{self.report_filename}.tmp", "w", encoding="utf-8") as report_file:
+            report_file.write(report)
+        os.replace(f"{self.report_filename}.tmp", self.report_filename)
+
+
+profiler = Profiler()
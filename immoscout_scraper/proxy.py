@@ -0,0 +1,78 @@
+import threading
+from functools import lru_cache
+from urllib.parse import urlencode, quote_plus
+
+from .config import get_api_key, load_config
+
+PROXY_BASE_URL = "https://proxy.scrapeops.io/v1/"
+
+FETCH_PROFILES = {
+    "plain": {},
+    "rendered": {"render_js": True, "bypass": "generic_level_3"},
+}
+
+# Credits billed per request; the dearest option on a request sets its price.
+# A "request_credits" object in config.json overrides these.
+REQUEST_CREDITS = {
+    "base": 1,
+    "render_js": 10,
+    "generic_level_1": 10,
+    "generic_level_2": 35,
+    "generic_level_3": 85,
+}
+
+# Modes are tried cheapest first; the last one is the full fetch every stage falls back to
+STAGE_FETCH_MODES = {
+    "search": ("plain", "rendered"),
+    "detail": ("plain", "rendered"),
+}
+
+
+class RequestTemplate:
+
+    def __init__(self, api_key, location="us", base_url=PROXY_BASE_URL, cache_size=4096, **options):
+        static_params = {"api_key": api_key, **options, "country": location}
+        # Everything but the target url is constant for a run, so it is encoded once
+        self.prefix = f"{base_url}?{urlencode(static_params)}&url="
+        self.proxy_url = lru_cache(maxsize=cache_size)(self.build_url)
+
+    def build_url(self, url):
+        return self.prefix + quote_plus(url)
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_request_template(location="us", stage=None, mode=None, provider=None):
+    if mode is None:
+        mode = STAGE_FETCH_MODES.get(stage, STAGE_FETCH_MODES["search"])[-1]
+    key = (provider.name if provider else None, location, mode)
+    template = _templates.get(key)
+    if template is None:
+        with _templates_lock:
+            template = _templates.get(key)
+            if template is None:
+                if provider is None:
+                    template = RequestTemplate(get_api_key(), location=location, **FETCH_PROFILES[mode])
+                else:
+                    # Providers can't set the fetch mode's keys (see RESERVED_PARAMS), so the two never overlap
+                    options = {**provider.params, **FETCH_PROFILES[mode]}
+                    template = RequestTemplate(provider.api_key, location=location, base_url=provider.base_url, **options)
+                _templates[key] = template
+    return template
+
+
+def get_scrapeops_url(url, location="us", stage=None, mode=None, provider=None):
+    return get_request_template(location, stage, mode, provider).proxy_url(url)
+
+
+def request_credits(mode):
+    costs = {**REQUEST_CREDITS, **load_config().get("request_credits", {})}
+    options = FETCH_PROFILES[mode]
+    credits = [costs["base"]]
+    if options.get("render_js"):
+        credits.append(costs["render_js"])
+    if options.get("bypass"):
+        credits.append(costs.get(options["bypass"], costs["base"]))
+    return max(credits)
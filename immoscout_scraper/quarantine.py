@@ -0,0 +1,70 @@
+import os
+import logging
+
+from .archive import ArchiveRecorder, PageArchive, read_index, read_body
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+page_quarantine = ArchiveRecorder()
+
+
+def quarantine_page(url, stage, response, error, meta=None):
+    body = getattr(response, "raw_body", None)
+    if body is None:
+        body = response.content
+    page_quarantine.record(url, stage, body, meta={**(meta or {}), "error": str(error)})
+    metrics.inc("quarantined_total", stage=stage)
+    logger.warning("Quarantined %s page %s: %s", stage, url, error)
+
+
+def reprocess_quarantine(path, pipeline_options=None):
+    from .models import CostData
+    from .pipeline import DataPipeline
+    from .scraper import parse_search_page, parse_detail_page
+
+    pipeline_options = pipeline_options or {}
+    entries = read_index(path)
+    # Pages that still fail go to a fresh quarantine that replaces the old one at the end
+    for stale in (f"{path}.next", f"{path}.next.idx"):
+        if os.path.exists(stale):
+            os.remove(stale)
+    remaining = PageArchive(f"{path}.next")
+    search_pipelines = {}
+    recovered = 0
+    with open(path, "rb") as data_file:
+        for entry in entries:
+            body = read_body(data_file, entry)
+            meta = entry.get("meta", {})
+            html = body.decode("utf-8", errors="replace")
+            try:
+                if entry["stage"] == "search":
+                    listings = parse_search_page(html)
+                    keyword = meta["keyword"]
+                    city = f"{keyword['state']}-{keyword['city']}"
+                    if city not in search_pipelines:
+                        search_pipelines[city] = DataPipeline(csv_filename=f"{city}.csv", **pipeline_options)
+                    for search_data in listings:
+                        search_pipelines[city].add_data(search_data)
+                else:
+                    values = parse_detail_page(html)
+                    costs_pipeline = DataPipeline(csv_filename=f"COST-{meta['name']}.csv", **pipeline_options)
+                    costs_pipeline.add_data(CostData(
+                        name=meta["name"],
+                        cold_rent=values["cold_rent"],
+                        price_per_m2=values["price_per_m2"],
+                        additional_costs=values["additional_costs"],
+                        total_cost=values["total_cost"],
+                        url=entry["url"]
+                    ))
+                    costs_pipeline.close_pipeline()
+                recovered += 1
+            except Exception as e:
+                remaining.append(entry["url"], entry["stage"], body, meta={**meta, "error": str(e)})
+    for search_pipeline in search_pipelines.values():
+        search_pipeline.close_pipeline()
+    remaining.close()
+    os.replace(f"{path}.next", path)
+    os.replace(f"{path}.next.idx", f"{path}.idx")
+    logger.info("Reprocessed %s quarantined pages: %s recovered, %s still failing", len(entries), recovered, len(entries) - recovered)
+    return recovered, len(entries) - recovered
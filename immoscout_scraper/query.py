@@ -0,0 +1,278 @@
+import os
+import re
+import csv
+import json
+import time
+import itertools
+import sqlite3
+import logging
+import threading
+from datetime import date
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .dedup import expose_id
+from .extract import parse_number
+from .writers import open_csv
+from .scraper import CRAWL_FILE_PATTERN
+
+logger = logging.getLogger(__name__)
+
+COST_FILE_PATTERN = re.compile(r"^COST-.*\.csv(\.gz|\.zst)?$")
+DATE_PATTERN = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+
+SORT_COLUMNS = ("price", "size", "available_from", "cold_rent", "total_cost", "last_seen")
+MAX_PAGE_SIZE = 500
+INGEST_BATCH_SIZE = 5000
+
+LISTING_COLUMNS = (
+    "expose_id", "city", "name", "price", "size", "date_available", "available_from", "url",
+    "cold_rent", "price_per_m2", "additional_costs", "total_cost", "first_seen", "last_seen",
+)
+
+
+def parse_available_from(value, today=None):
+    match = DATE_PATTERN.search(value or "")
+    if match:
+        day, month, year = (int(part) for part in match.groups())
+        try:
+            return date(year, month, day).isoformat()
+        except ValueError:
+            return None
+    # "sofort" (immediately) is the other common value; anything else stays unknown
+    if "sofort" in (value or "").lower():
+        return (today or date.today()).isoformat()
+    return None
+
+
+class ResultStore:
+
+    def __init__(self, db_filename="results.db"):
+        self.db_filename = db_filename
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_filename, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        # Price and size ride along in each other's indexes, so combined filters count without table lookups
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS listings (
+                expose_id TEXT PRIMARY KEY,
+                city TEXT NOT NULL,
+                name TEXT NOT NULL,
+                price REAL,
+                size REAL,
+                date_available TEXT,
+                available_from TEXT,
+                url TEXT,
+                cold_rent REAL,
+                price_per_m2 REAL,
+                additional_costs REAL,
+                total_cost REAL,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS listings_city_price ON listings (city, price, size);
+            CREATE INDEX IF NOT EXISTS listings_city_size ON listings (city, size, price);
+            CREATE INDEX IF NOT EXISTS listings_city_available ON listings (city, available_from);
+            CREATE INDEX IF NOT EXISTS listings_city_total ON listings (city, total_cost);
+            CREATE INDEX IF NOT EXISTS listings_price ON listings (price, size);
+            CREATE INDEX IF NOT EXISTS listings_size ON listings (size, price);
+            CREATE INDEX IF NOT EXISTS listings_name ON listings (name);
+        """)
+        self.connection.commit()
+
+    def ingest_listings(self, rows, city):
+        now = time.time()
+        records = []
+        for row in rows:
+            listing_id = expose_id(row.get("url"))
+            if not listing_id:
+                continue
+            records.append((
+                listing_id,
+                city,
+                row.get("name", ""),
+                parse_number(row.get("price")),
+                parse_number(row.get("size")),
+                row.get("date_available"),
+                parse_available_from(row.get("date_available")),
+                row.get("url"),
+                now,
+                now,
+            ))
+        with self.lock:
+            self.connection.executemany("""
+                INSERT INTO listings (expose_id, city, name, price, size, date_available, available_from, url,
+                                      first_seen, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (expose_id) DO UPDATE SET
+                    city = excluded.city,
+                    name = excluded.name,
+                    price = excluded.price,
+                    size = excluded.size,
+                    date_available = excluded.date_available,
+                    available_from = excluded.available_from,
+                    url = excluded.url,
+                    last_seen = excluded.last_seen
+            """, records)
+            self.connection.commit()
+        return len(records)
+
+    def ingest_costs(self, rows):
+        by_id = []
+        by_name = []
+        for row in rows:
+            values = (
+                parse_number(row.get("cold_rent")),
+                parse_number(row.get("price_per_m2")),
+                parse_number(row.get("additional_costs")),
+                parse_number(row.get("total_cost")),
+            )
+            listing_id = expose_id(row.get("url"))
+            name = row.get("name", "")
+            if listing_id:
+                by_id.append((*values, listing_id))
+            elif name and name != "No name":
+                # Cost files from before the url column only carry a name, which is trusted
+                # only where it points at a single listing
+                by_name.append((*values, name, name))
+        with self.lock:
+            self.connection.executemany("""
+                UPDATE listings SET cold_rent = ?, price_per_m2 = ?, additional_costs = ?, total_cost = ?
+                WHERE expose_id = ?
+            """, by_id)
+            self.connection.executemany("""
+                UPDATE listings SET cold_rent = ?, price_per_m2 = ?, additional_costs = ?, total_cost = ?
+                WHERE name = ? AND (SELECT COUNT(*) FROM listings WHERE name = ?) = 1
+            """, by_name)
+            self.connection.commit()
+        return len(by_id) + len(by_name)
+
+    def ingest_file(self, path):
+        filename = os.path.basename(path)
+        total = 0
+        with open_csv(path) as csv_file:
+            reader = csv.DictReader(csv_file)
+            # Rows go in a batch at a time, so a large crawl file never sits in memory whole
+            while True:
+                rows = list(itertools.islice(reader, INGEST_BATCH_SIZE))
+                if not rows:
+                    break
+                if COST_FILE_PATTERN.match(filename):
+                    total += self.ingest_costs(rows)
+                else:
+                    total += self.ingest_listings(rows, CRAWL_FILE_PATTERN.sub("", filename))
+        return total
+
+    def query(self, city=None, min_price=None, max_price=None, min_size=None, max_size=None,
+              available_after=None, available_before=None, max_total_cost=None,
+              order_by="price", descending=False, limit=50, offset=0):
+        if order_by not in SORT_COLUMNS:
+            raise ValueError(f"order_by must be one of {', '.join(SORT_COLUMNS)}")
+        # Rows without a value for the sort column are left out, so the sort can walk an index
+        conditions = [f"{order_by} IS NOT NULL"]
+        params = []
+        for column, operator, value in (
+            ("city", "=", city),
+            ("price", ">=", min_price),
+            ("price", "<=", max_price),
+            ("size", ">=", min_size),
+            ("size", "<=", max_size),
+            ("available_from", ">=", available_after),
+            ("available_from", "<=", available_before),
+            ("total_cost", "<=", max_total_cost),
+        ):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}"
+        direction = "DESC" if descending else "ASC"
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        sql = f"""
+            SELECT {', '.join(LISTING_COLUMNS)} FROM listings {where}
+            ORDER BY {order_by} {direction}, rowid {direction}
+            LIMIT ? OFFSET ?
+        """
+        with self.lock:
+            rows = self.connection.execute(sql, (*params, limit, int(offset))).fetchall()
+            total = self.connection.execute(f"SELECT COUNT(*) FROM listings {where}", params).fetchone()[0]
+        return {"total": total, "limit": limit, "offset": int(offset), "results": [dict(row) for row in rows]}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def ingest_files(store, paths):
+    total = 0
+    # Listings first, so cost rows find the listing they belong to
+    for path in sorted(paths, key=lambda path: bool(COST_FILE_PATTERN.match(os.path.basename(path)))):
+        total += store.ingest_file(path)
+    logger.info("Ingested %s rows from %s files into %s", total, len(paths), store.db_filename)
+    return total
+
+
+QUERY_PARAMETERS = {
+    "city": str,
+    "min_price": float,
+    "max_price": float,
+    "min_size": float,
+    "max_size": float,
+    "available_after": str,
+    "available_before": str,
+    "max_total_cost": float,
+    "order_by": str,
+    "limit": int,
+    "offset": int,
+}
+
+
+def parse_query_parameters(query_string):
+    params = {}
+    for name, values in parse_qs(query_string).items():
+        if name == "descending":
+            params["descending"] = values[-1].lower() in ("1", "true", "yes")
+        elif name in QUERY_PARAMETERS:
+            params[name] = QUERY_PARAMETERS[name](values[-1])
+        else:
+            raise ValueError(f"unknown query parameter {name}")
+    return params
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/listings":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            result = self.server.result_store.query(**parse_query_parameters(url.query))
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+def serve_results(store, host="127.0.0.1", port=8766):
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.result_store = store
+    logger.info("Serving listing queries on http://%s:%s/listings", host, server.server_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
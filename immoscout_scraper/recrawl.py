@@ -0,0 +1,57 @@
+import math
+import time
+import heapq
+import logging
+
+from .dedup import expose_id, card_fingerprint
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+# Until a listing has some history it is assumed to change about once a week
+PRIOR_CHANGES = 1
+PRIOR_DAYS = 7.0
+
+
+def change_rate(history):
+    if history is None:
+        return PRIOR_CHANGES / PRIOR_DAYS
+    observed_days = (history["last_observed"] - history["first_observed"]) / DAY
+    return (history["changes"] + PRIOR_CHANGES) / (observed_days + PRIOR_DAYS)
+
+
+def change_probability(row, seen_index, now=None):
+    now = now or time.time()
+    listing_id = expose_id(row["url"])
+    if not listing_id:
+        return 1.0
+    state = seen_index.detail_state(listing_id)
+    if state is None:
+        return 1.0
+    if "price" in row and state["card_fingerprint"] != card_fingerprint(row):
+        return 1.0
+    history = seen_index.change_history(listing_id)
+    if history is None:
+        return 1.0
+    # Changes are treated as a Poisson process, so the chance of at least one since the last look
+    days_since = max(now - history["last_observed"], 0) / DAY
+    return 1 - math.exp(-change_rate(history) * days_since)
+
+
+def plan_recrawl(rows, seen_index, budget):
+    now = time.time()
+    total = 0
+    scored = []
+    for row in rows:
+        total += 1
+        # Ties go to the row listed first
+        scored.append((change_probability(row, seen_index, now), -total, row))
+        # Only the best `budget` rows are ever kept, however long the input is
+        if len(scored) > 2 * budget + 1000:
+            scored = heapq.nlargest(budget, scored)
+    planned = heapq.nlargest(budget, scored)
+    expected = sum(probability for probability, _, _ in planned)
+    metrics.inc("detail_skipped_total", total - len(planned), reason="planned")
+    logger.info("Recrawl plan: %s of %s listings, %.1f expected changes", len(planned), total, expected)
+    return [row for _, _, row in planned]
@@ -0,0 +1,112 @@
+import random
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+
+from .config import load_config
+from .metrics import metrics
+from .proxy import PROXY_BASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Answers that say more about the proxy than about the page, so another provider may do better
+PROVIDER_FAILURE_STATUSES = frozenset({401, 403, 429, 500, 502, 503, 504})
+
+
+# Set by RequestTemplate or by the fetch mode, which is also what credits are billed on
+RESERVED_PARAMS = frozenset({"api_key", "location", "country", "base_url", "cache_size", "url", "render_js", "bypass"})
+
+
+@dataclass(frozen=True)
+class ProxyProvider:
+    name: str
+    base_url: str
+    api_key: str
+    weight: float = 1.0
+    params: dict = field(default_factory=dict, hash=False, compare=False)
+
+    def __post_init__(self):
+        reserved = RESERVED_PARAMS.intersection(self.params)
+        if reserved:
+            raise ValueError(f"proxy provider {self.name} can't set {', '.join(sorted(reserved))} in params")
+
+
+def load_providers():
+    config = load_config()
+    entries = config.get("proxy_providers")
+    if not entries:
+        return [ProxyProvider("scrapeops", PROXY_BASE_URL, config["api_key"])]
+    return [
+        ProxyProvider(
+            entry["name"],
+            entry.get("base_url", PROXY_BASE_URL),
+            entry.get("api_key", config.get("api_key")),
+            weight=entry.get("weight", 1.0),
+            params=entry.get("params", {})
+        )
+        for entry in entries
+    ]
+
+
+class ProxyRouter:
+
+    def __init__(self, window=200, explore=0.1, min_samples=5):
+        self.window = window
+        self.explore = explore
+        self.min_samples = min_samples
+        self.providers = None
+        self.outcomes = {}
+        self.lock = threading.Lock()
+
+    def configure(self, providers=None, explore=None):
+        with self.lock:
+            self.providers = providers
+            self.outcomes = {}
+        if explore is not None:
+            self.explore = explore
+
+    def get_providers(self):
+        if self.providers is None:
+            with self.lock:
+                if self.providers is None:
+                    self.providers = load_providers()
+        return self.providers
+
+    def score(self, provider):
+        with self.lock:
+            outcomes = list(self.outcomes.get(provider.name, ()))
+        # Too little history to judge, so it scores as if perfect and gets its share of traffic
+        if len(outcomes) < self.min_samples:
+            return provider.weight
+        successes = [seconds for seconds, ok in outcomes if ok]
+        if not successes:
+            return provider.weight * 0.01
+        success_rate = len(successes) / len(outcomes)
+        mean_latency = sum(successes) / len(successes)
+        return provider.weight * success_rate / max(mean_latency, 0.05)
+
+    def route(self):
+        providers = self.get_providers()
+        if len(providers) == 1:
+            return list(providers)
+        scores = {provider.name: self.score(provider) for provider in providers}
+        if random.random() < self.explore:
+            first = random.choice(providers)
+        else:
+            first = random.choices(providers, weights=[scores[provider.name] for provider in providers])[0]
+        # Whatever is left is the failover order, best first
+        rest = sorted((provider for provider in providers if provider is not first), key=lambda p: -scores[p.name])
+        return [first, *rest]
+
+    def record(self, provider, seconds, ok):
+        with self.lock:
+            outcomes = self.outcomes.get(provider.name)
+            if outcomes is None:
+                outcomes = self.outcomes[provider.name] = deque(maxlen=self.window)
+            outcomes.append((seconds, ok))
+        metrics.inc("proxy_requests_total", provider=provider.name, outcome="ok" if ok else "failed")
+        metrics.observe("proxy_seconds", seconds, provider=provider.name)
+
+
+proxy_router = ProxyRouter()
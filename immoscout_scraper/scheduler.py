@@ -0,0 +1,206 @@
+import heapq
+import logging
+import itertools
+import threading
+import concurrent.futures
+from dataclasses import dataclass, field
+
+from .pipeline import DataPipeline
+from .profiling import profiler
+from .metrics import metrics
+from .proxy import STAGE_FETCH_MODES, request_credits
+from .credits import credit_ledger, BudgetExhausted
+from .dedup import expose_id
+from .recrawl import plan_recrawl
+from .scraper import scrape_search_results, process_listing, card_unchanged
+
+logger = logging.getLogger(__name__)
+
+STAGE_PRIORITIES = {"detail": 0, "search": 1}
+# Until the first search pages come back, assume a full page of listings
+LISTINGS_PER_PAGE = 20
+
+
+@dataclass(order=True)
+class WorkItem:
+    sort_key: tuple
+    stage: str = field(compare=False)
+    keyword: dict = field(compare=False)
+    page_number: int = field(default=0, compare=False)
+    row: dict = field(default=None, compare=False)
+    planned: bool = field(default=False, compare=False)
+
+
+class CrawlScheduler:
+
+    def __init__(self, location, max_threads=5, retries=3, stage_priorities=None, fresh_first=True, detail=True,
+                 seen_index=None, recrawl_budget=None, pipeline_options=None, detail_pipeline_options=None):
+        self.location = location
+        self.detail = detail
+        self.seen_index = seen_index
+        self.recrawl_budget = recrawl_budget if seen_index is not None else None
+        self.known_listings = []
+        self.pending_search = 0
+        self.pipeline_options = pipeline_options or {}
+        self.detail_pipeline_options = detail_pipeline_options or {}
+        self.max_threads = max_threads
+        self.retries = retries
+        self.stage_priorities = stage_priorities or STAGE_PRIORITIES
+        self.fresh_first = fresh_first
+        self.queue = []
+        self.counter = itertools.count()
+        self.city_turns = {}
+        self.pending_pages = {}
+        self.pipelines = {}
+        self.aggregate_files = []
+        self.in_flight = 0
+        self.search_pages = 0
+        self.search_listings = 0
+        self.condition = threading.Condition()
+
+    def city_key(self, keyword):
+        return f"{keyword['state']}-{keyword['city']}"
+
+    def push(self, stage, keyword, page_number=0, row=None, planned=False):
+        city = self.city_key(keyword)
+        with self.condition:
+            # Round robin between cities: every city's n-th item of a stage sorts together
+            turn = self.city_turns.get((stage, city), 0)
+            self.city_turns[(stage, city)] = turn + 1
+            freshness = page_number if self.fresh_first else 0
+            # On a credit budget the stage that yields the most records per credit goes first
+            rank = -self.value_per_credit(stage) if credit_ledger.budget is not None else self.stage_priorities[stage]
+            sort_key = (rank, freshness, turn, next(self.counter))
+            heapq.heappush(self.queue, WorkItem(sort_key, stage, keyword, page_number, row, planned))
+            self.condition.notify()
+
+    def value_per_credit(self, stage):
+        if stage == "search":
+            value = self.search_listings / self.search_pages if self.search_pages else LISTINGS_PER_PAGE
+        else:
+            value = 1
+        return value / credit_ledger.average_cost(stage, request_credits(STAGE_FETCH_MODES[stage][0]))
+
+    def add_city(self, keyword, pages):
+        city = self.city_key(keyword)
+        self.pipelines[city] = DataPipeline(
+            csv_filename=f"{city}.csv",
+            seen_index=self.seen_index,
+            **self.pipeline_options
+        )
+        self.pending_pages[city] = pages
+        with self.condition:
+            self.pending_search += pages
+        for page_number in range(pages):
+            self.push("search", keyword, page_number=page_number)
+
+    def next_item(self):
+        with self.condition:
+            while not self.queue:
+                if self.in_flight == 0:
+                    return None
+                self.condition.wait()
+            self.in_flight += 1
+            return heapq.heappop(self.queue)
+
+    def task_done(self):
+        with self.condition:
+            self.in_flight -= 1
+            if self.in_flight == 0 and not self.queue:
+                self.condition.notify_all()
+
+    def run_search(self, item):
+        city = self.city_key(item.keyword)
+        listings = []
+
+        def on_listing(search_data):
+            listings.append(search_data)
+            row = {"name": search_data.name, "url": search_data.url, "price": search_data.price, "size": search_data.size}
+            if self.recrawl_budget is not None and self.seen_index.detail_state(expose_id(row["url"])) is not None:
+                # Known listings wait for the recrawl plan; new ones are always fetched
+                with self.condition:
+                    self.known_listings.append((item.keyword, item.page_number, row))
+                return
+            self.push("detail", item.keyword, page_number=item.page_number, row=row)
+
+        try:
+            scrape_search_results(
+                item.keyword,
+                self.location,
+                item.page_number,
+                data_pipeline=self.pipelines[city],
+                retries=self.retries,
+                on_listing=on_listing if self.detail else None
+            )
+            with self.condition:
+                self.search_pages += 1
+                self.search_listings += len(listings)
+        finally:
+            with self.condition:
+                self.pending_pages[city] -= 1
+                self.pending_search -= 1
+                city_done = self.pending_pages[city] == 0
+                search_done = self.pending_search == 0
+            if search_done and self.known_listings:
+                self.plan_known_listings()
+            if city_done:
+                self.pipelines[city].close_pipeline()
+                self.aggregate_files.extend(self.pipelines[city].output_files)
+                logger.info("Crawl complete for %s", city)
+
+    def plan_known_listings(self):
+        # Runs while the last search page is still in flight, so no worker exits before the push
+        with self.condition:
+            known_listings, self.known_listings = self.known_listings, []
+        keywords = {id(row): (keyword, page_number) for keyword, page_number, row in known_listings}
+        rows = [row for _, _, row in known_listings]
+        for row in plan_recrawl(rows, self.seen_index, self.recrawl_budget):
+            keyword, page_number = keywords[id(row)]
+            self.push("detail", keyword, page_number=page_number, row=row, planned=True)
+
+    def run_detail(self, item):
+        # Listings picked by the recrawl plan are fetched even when their card looks the same
+        if not item.planned and self.seen_index is not None and card_unchanged(item.row, self.seen_index):
+            logger.info("Card for %s unchanged, skipping details", item.row["url"])
+            return
+        process_listing(
+            item.row,
+            self.location,
+            retries=self.retries,
+            pipeline_options=self.detail_pipeline_options,
+            seen_index=self.seen_index,
+            city=self.city_key(item.keyword)
+        )
+
+    def worker(self):
+        with profiler.attach_worker():
+            while True:
+                item = self.next_item()
+                if item is None:
+                    return
+                try:
+                    if item.stage == "detail" and credit_ledger.degraded:
+                        metrics.inc("detail_skipped_total", reason="budget")
+                    elif item.stage == "search":
+                        self.run_search(item)
+                    else:
+                        self.run_detail(item)
+                except BudgetExhausted as e:
+                    metrics.inc("budget_skipped_total", stage=item.stage)
+                    logger.warning("Skipping %s task for %s: %s", item.stage, self.city_key(item.keyword), e)
+                except Exception as e:
+                    logger.error("%s task failed for %s: %s", item.stage, self.city_key(item.keyword), e)
+                finally:
+                    self.task_done()
+
+    def run(self, executor=None):
+        # A long-lived executor keeps its threads warm from one run to the next
+        if executor is not None:
+            concurrent.futures.wait([executor.submit(self.worker) for _ in range(self.max_threads)])
+            return self.aggregate_files
+        workers = [threading.Thread(target=self.worker) for _ in range(self.max_threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return self.aggregate_files
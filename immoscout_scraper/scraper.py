@@ -0,0 +1,322 @@
+import os
+import re
+import csv
+import time
+import logging
+import concurrent.futures
+
+from .models import SearchData, CostData
+from .pipeline import DataPipeline
+from .dedup import expose_id, card_fingerprint, content_hash
+from .fetch import fetch_page, conditional_headers
+from .proxy import STAGE_FETCH_MODES, request_credits
+from .credits import credit_ledger, BudgetExhausted
+from .streaming import decode_body, extract_cost_block
+from .writers import open_csv
+from .neardup import collapse_rows
+from .extract import SEARCH_CARD_PLAN, DETAIL_PLAN, ParseError
+from .quarantine import page_quarantine, quarantine_page
+from .history import price_history
+from .metrics import metrics, retry_cause
+from .profiling import profiler
+from .logs import HOT_LOOP
+
+logger = logging.getLogger(__name__)
+
+# Whatever follows the city in a crawl file name: a distributed worker's "--{worker_id}",
+# a rotated shard's "-00001" and the extension
+CRAWL_FILE_PATTERN = re.compile(r"(--.*)?(-\d{5})?\.csv(\.gz|\.zst)?$")
+
+
+def parse_search_page(html, url=None):
+    # Heavy imports wait for the first page so CLI startup and worker spawns stay fast
+    from bs4 import BeautifulSoup
+
+    with profiler.stage(url, "parse"):
+        soup = BeautifulSoup(html, "html.parser")
+
+    div_cards = soup.find_all("div", class_="result-list-entry__data")
+    if not div_cards:
+        raise ParseError("Listings failed to load!")
+
+    listings = []
+    with profiler.stage(url, "extract"):
+        for card in div_cards:
+            values = SEARCH_CARD_PLAN.extract_all(card)
+            href = values["href"]
+            link = ""
+            prefix =  "https://www.immobilienscout24.de"
+            if prefix in href:
+                continue
+            else:
+                link = f"{prefix}{href}"
+
+            date_available = "n/a"
+            date_text = values["date_text"]
+            if "Zi" not in date_text:
+                date_available = date_text
+
+            listings.append(SearchData(
+                name=values["name"],
+                price=values["price"],
+                size=values["size"],
+                date_available=date_available,
+                url=link
+            ))
+    return listings
+
+
+def parse_detail_page(html, url=None):
+    from bs4 import BeautifulSoup
+
+    with profiler.stage(url, "parse"):
+        soup = BeautifulSoup(html, "html.parser")
+    with profiler.stage(url, "extract"):
+        return DETAIL_PLAN.extract_all(soup)
+
+
+def scrape_search_results(search_info, location, page_number, data_pipeline=None, retries=3, on_listing=None):
+    base_url = f"https://www.immobilienscout24.de/Suche/de/{search_info['state']}/{search_info['city']}/wohnung-mieten"
+    city = f"{search_info['state']}-{search_info['city']}"
+    url = ""
+    if page_number != 0:
+        url = f"{base_url}?pagenumber={page_number+1}"
+    else:
+        url = base_url
+    tries = 0
+    success = False
+    
+    while tries <= retries and not success:
+        try:
+            response = fetch_page(url, location=location, stage="search", city=city)
+            logger.info("Recieved [%s] from: %s", response.status_code, url, extra=HOT_LOOP)
+            if response.status_code != 200:
+                raise Exception(f"Failed request, Status Code {response.status_code}")
+                
+            start_time = time.perf_counter()
+            records = 0
+            with profiler.stage(url, "decode"):
+                html = decode_body(response)
+            listings = parse_search_page(html, url=url)
+            metrics.observe("parse_seconds", time.perf_counter() - start_time, stage="search")
+            for search_data in listings:
+                # Known listings are still price observations, even when the pipeline drops them
+                price_history.record(search_data.url, "price", search_data.price)
+                with profiler.stage(url, "store"):
+                    dropped = data_pipeline.add_record(search_data)
+                if dropped is None:
+                    records += 1
+                # Listings known from an earlier run still reach the detail stage, which decides
+                # whether they changed enough to refetch
+                if on_listing and dropped in (None, "index"):
+                    on_listing(search_data)
+
+            metrics.inc("records_emitted_total", records, stage="search")
+            logger.info("Successfully parsed data from: %s", url, extra=HOT_LOOP)
+            success = True
+        
+                    
+        except BudgetExhausted:
+            raise
+        except Exception as e:
+            # A page that arrived but can't be parsed won't parse any better when fetched again
+            if isinstance(e, ParseError) and page_quarantine.enabled:
+                quarantine_page(url, "search", response, e, meta={"keyword": search_info, "page_number": page_number})
+                raise
+            metrics.inc("retries_total", stage="search", cause=retry_cause(e))
+            logger.error("An error occurred while processing page %s: %s", url, e, extra=HOT_LOOP)
+            logger.info("Retrying request for page: %s, retries left %s", url, retries - tries, extra=HOT_LOOP)
+            tries+=1
+
+    if not success:
+        raise Exception(f"Max Retries exceeded: {retries}")
+
+
+def start_scrape(keyword, pages, location, data_pipeline=None, max_threads=5, retries=3):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
+        executor.map(
+            scrape_search_results,
+            [keyword] * pages,
+            [location] * pages,
+            range(pages),
+            [data_pipeline] * pages,
+            [retries] * pages
+        )
+
+
+def process_listing(row, location, retries=3, stream=True, pipeline_options=None, seen_index=None, city=None):
+    url = row["url"]
+    listing_id = expose_id(url) if seen_index is not None else None
+    previous = seen_index.detail_state(listing_id) if listing_id else None
+    headers = conditional_headers(previous["etag"], previous["last_modified"]) if previous else None
+    tries = 0
+    success = False
+
+    while tries <= retries and not success:
+        try:
+            response = fetch_page(
+                url,
+                location=location,
+                stage="detail",
+                extract=extract_cost_block if stream else None,
+                meta={"name": row["name"]},
+                headers=headers,
+                city=city
+            )
+            if response.status_code == 304:
+                metrics.inc("detail_unchanged_total", via="not_modified")
+                seen_index.mark_detail_unchanged(listing_id, card_fingerprint(row))
+                logger.info("Details for %s not modified", url, extra=HOT_LOOP)
+                return None
+            if response.status_code == 200:
+                logger.info("Status: %s", response.status_code, extra=HOT_LOOP)
+                if stream:
+                    # fetch_page parsed the page while it streamed in, and timed that as parse
+                    values = response.extracted
+                    if values is None:
+                        raise ParseError("Cost block missing from page")
+                else:
+                    start_time = time.perf_counter()
+                    with profiler.stage(url, "decode"):
+                        html = decode_body(response)
+                    values = parse_detail_page(html, url=url)
+                    metrics.observe("parse_seconds", time.perf_counter() - start_time, stage="detail")
+
+                costs_pipeline = DataPipeline(csv_filename=f"COST-{row['name']}.csv", **(pipeline_options or {}))
+                cost_data = CostData(
+                    name=row["name"],
+                    cold_rent=values["cold_rent"],
+                    price_per_m2=values["price_per_m2"],
+                    additional_costs=values["additional_costs"],
+                    total_cost=values["total_cost"],
+                    url=url
+                )
+                price_history.record(url, "total_cost", values["total_cost"])
+                digest = content_hash(values)
+                if previous is not None and previous["content_hash"] == digest:
+                    # Same cost block as last time, so there is nothing new to append
+                    metrics.inc("detail_unchanged_total", via="content_hash")
+                else:
+                    with profiler.stage(url, "store"):
+                        if costs_pipeline.add_data(cost_data):
+                            metrics.inc("records_emitted_total", stage="detail")
+                        costs_pipeline.close_pipeline()
+                if listing_id:
+                    seen_index.record_detail(
+                        listing_id,
+                        card_fingerprint(row),
+                        etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"),
+                        content_hash=digest
+                    )
+                success = True
+
+            else:
+                logger.warning("Failed Response: %s", response.status_code, extra=HOT_LOOP)
+                raise Exception(f"Failed Request, status code: {response.status_code}")
+        except BudgetExhausted:
+            raise
+        except Exception as e:
+            if isinstance(e, ParseError) and page_quarantine.enabled:
+                quarantine_page(url, "detail", response, e, meta={"name": row["name"]})
+                raise
+            metrics.inc("retries_total", stage="detail", cause=retry_cause(e))
+            logger.error("Exception thrown: %s", e, extra=HOT_LOOP)
+            logger.warning("Failed to process page: %s, Retries left: %s", row["url"], retries - tries, extra=HOT_LOOP)
+            tries += 1
+
+    if not success:
+        raise Exception(f"Max Retries exceeded: {retries}")
+    else:
+        logger.info("Successfully parsed: %s", row["url"], extra=HOT_LOOP)
+    return cost_data
+
+
+def submit_bounded(executor, fn, items, *args, max_pending=10, **kwargs):
+    pending = set()
+    for item in items:
+        # Only read the next item once a slot frees up, so memory stays flat however long the input is
+        if len(pending) >= max_pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            log_failures(done)
+        pending.add(executor.submit(fn, item, *args, **kwargs))
+    done, _ = concurrent.futures.wait(pending)
+    log_failures(done)
+
+
+def log_failures(futures):
+    for future in futures:
+        error = future.exception()
+        if error is not None:
+            logger.error("Listing failed: %s", error)
+
+
+def card_unchanged(row, seen_index):
+    listing_id = expose_id(row["url"])
+    if not listing_id or "price" not in row:
+        return False
+    state = seen_index.detail_state(listing_id)
+    if state is None or state["card_fingerprint"] != card_fingerprint(row):
+        return False
+    seen_index.mark_detail_unchanged(listing_id, observed=False)
+    metrics.inc("detail_skipped_total", reason="unchanged")
+    return True
+
+
+def skip_fetched(rows, seen_index):
+    for row in rows:
+        if not card_unchanged(row, seen_index):
+            yield row
+
+
+def read_rows(csv_files):
+    for csv_file in csv_files:
+        logger.info("processing %s", csv_file)
+        with open_csv(csv_file) as file:
+            yield from csv.DictReader(file)
+
+
+def within_budget(rows):
+    cheapest = request_credits(STAGE_FETCH_MODES["detail"][0])
+    for row in rows:
+        if not credit_ledger.allows(cheapest):
+            logger.warning("Credit budget spent, leaving the remaining listings for the next run")
+            return
+        yield row
+
+
+def process_rows(rows, location, max_threads=5, retries=3, max_pending=None, seen_index=None,
+                 pipeline_options=None, city=None):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
+        submit_bounded(
+            executor,
+            process_listing,
+            within_budget(rows),
+            location,
+            max_pending=max_pending or max_threads * 2,
+            seen_index=seen_index,
+            retries=retries,
+            pipeline_options=pipeline_options,
+            city=city
+        )
+
+
+def process_results(csv_file, location, max_threads=5, retries=3, max_pending=None, seen_index=None,
+                    pipeline_options=None):
+    rows = read_rows([csv_file])
+    near_duplicates = (pipeline_options or {}).get("near_duplicates")
+    if near_duplicates is not None:
+        rows = collapse_rows(rows, near_duplicates)
+    if seen_index is not None:
+        rows = skip_fetched(rows, seen_index)
+    process_rows(
+        rows,
+        location,
+        max_threads=max_threads,
+        retries=retries,
+        max_pending=max_pending,
+        seen_index=seen_index,
+        pipeline_options=pipeline_options,
+        # Crawl output is named {state}-{city}.csv, optionally sharded and compressed
+        city=CRAWL_FILE_PATTERN.sub("", os.path.basename(csv_file))
+    )
@@ -0,0 +1,85 @@
+import re
+import codecs
+from html.parser import HTMLParser
+
+from .archive import page_archive
+from .quarantine import page_quarantine
+from .extract import DETAIL_PLAN
+from .metrics import metrics
+
+CHUNK_SIZE = 16384
+
+def known_encoding(response, default="utf-8"):
+    # Only trust a charset the server actually sent, never guess one from the body
+    match = re.search(r"charset=([\w.:-]+)", response.headers.get("Content-Type", ""), re.IGNORECASE)
+    return match.group(1) if match else default
+
+
+def decode_body(response):
+    return response.content.decode(known_encoding(response), errors="replace")
+
+
+class FieldStreamParser(HTMLParser):
+
+    def __init__(self, plan=DETAIL_PLAN):
+        super().__init__(convert_charrefs=True)
+        # Streaming supports the flat specs: one tag plus class token per field
+        self.wanted = {(spec.tag, spec.class_token): spec for spec in plan.specs}
+        self.tags = {spec.tag for spec in plan.specs}
+        self.values = {}
+        self.current = None
+        self.parts = []
+
+    @property
+    def complete(self):
+        return len(self.values) == len(self.wanted)
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in self.tags or self.current:
+            return
+        for token in (dict(attrs).get("class") or "").split():
+            spec = self.wanted.get((tag, token))
+            if spec and spec.name not in self.values:
+                self.current = spec
+                self.parts = []
+                return
+
+    def handle_data(self, data):
+        if self.current:
+            self.parts.append(data)
+
+    def handle_endtag(self, tag):
+        if self.current and tag == self.current.tag:
+            self.values[self.current.name] = self.current.clean("".join(self.parts))
+            self.current = None
+
+
+def stream_extract(response, parser, stage="detail", chunk_size=CHUNK_SIZE):
+    decoder = codecs.getincrementaldecoder(known_encoding(response))(errors="replace")
+    bytes_read = 0
+    # The archive needs whole pages, so archiving turns the early abort off
+    keep_body = page_archive.enabled or page_quarantine.enabled
+    archived_chunks = [] if keep_body else None
+    try:
+        for chunk in response.iter_content(chunk_size):
+            bytes_read += len(chunk)
+            if archived_chunks is not None:
+                archived_chunks.append(chunk)
+            if not parser.complete:
+                parser.feed(decoder.decode(chunk))
+            # Everything we need has been seen, so the rest of the body is never read
+            if parser.complete and not page_archive.enabled:
+                break
+        else:
+            parser.feed(decoder.decode(b"", final=True))
+            parser.close()
+    finally:
+        response.close()
+        if archived_chunks is not None:
+            response.raw_body = b"".join(archived_chunks)
+        metrics.inc("response_bytes_total", bytes_read, stage=stage)
+    return parser.values if parser.complete else None
+
+
+def extract_cost_block(response):
+    return stream_extract(response, FieldStreamParser(DETAIL_PLAN), stage="detail")
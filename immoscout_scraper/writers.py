@@ -0,0 +1,158 @@
+import io
+import os
+import re
+import csv
+import sys
+import gzip
+import glob
+import json
+import time
+import socket
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def compressed_stream(raw_file, compression):
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw_file, mode="wb")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor().stream_writer(raw_file, closefd=False)
+    return raw_file
+
+
+def open_csv(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="", encoding="utf-8")
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("reading .zst files requires the zstandard package")
+        raw_file = open(path, "rb")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw_file, closefd=True), encoding="utf-8", newline="")
+    return open(path, newline="", encoding="utf-8")
+
+
+class ShardWriter:
+
+    def __init__(self, csv_filename, compression=None, rotate_bytes=None, rotate_seconds=None):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise Exception(f"Unknown compression: {compression}")
+        self.base = csv_filename[:-4] if csv_filename.endswith(".csv") else csv_filename
+        self.compression = compression
+        self.suffix = ".csv" + COMPRESSION_SUFFIXES[compression]
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.shard_number = self.last_shard_number()
+        self.raw_file = None
+        self.text_file = None
+        self.writer = None
+        self.opened_at = 0
+        self.output_files = []
+        self.lock = threading.Lock()
+
+    def last_shard_number(self):
+        pattern = re.compile(re.escape(os.path.basename(self.base)) + r"-(\d+)" + re.escape(self.suffix) + "$")
+        numbers = [0]
+        for path in glob.glob(f"{glob.escape(self.base)}-*{self.suffix}"):
+            match = pattern.search(os.path.basename(path))
+            if match:
+                numbers.append(int(match.group(1)))
+        return max(numbers)
+
+    def shard_path(self):
+        return f"{self.base}-{self.shard_number:05d}{self.suffix}"
+
+    def should_rotate(self):
+        if self.raw_file is None:
+            return True
+        if self.rotate_bytes and self.raw_file.tell() >= self.rotate_bytes:
+            return True
+        return bool(self.rotate_seconds) and time.time() - self.opened_at >= self.rotate_seconds
+
+    def open_shard(self, keys):
+        self.shard_number += 1
+        # Shards are written under a .tmp name and renamed into place only once complete
+        self.raw_file = open(f"{self.shard_path()}.tmp", "wb")
+        stream = compressed_stream(self.raw_file, self.compression)
+        self.text_file = io.TextIOWrapper(stream, encoding="utf-8", newline="", write_through=True)
+        self.writer = csv.DictWriter(self.text_file, fieldnames=keys)
+        self.writer.writeheader()
+        self.opened_at = time.time()
+
+    def close_shard(self):
+        if self.raw_file is None:
+            return
+        self.text_file.close()
+        if not self.raw_file.closed:
+            self.raw_file.close()
+        os.replace(f"{self.shard_path()}.tmp", self.shard_path())
+        self.output_files.append(self.shard_path())
+        self.raw_file = None
+
+    def write_rows(self, keys, rows):
+        with self.lock:
+            if self.should_rotate():
+                self.close_shard()
+                self.open_shard(keys)
+            self.writer.writerows(rows)
+
+    def close(self):
+        with self.lock:
+            self.close_shard()
+
+
+def encode_record(record):
+    # vars() hands the dataclass's own attribute dict to the encoder instead of copying it like asdict
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(vars(record), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class JsonLinesSink:
+
+    def __init__(self, target):
+        self.target = target
+        self.sock = None
+        self.fd = None
+        self.owns_fd = False
+        self.lock = threading.Lock()
+        if target == "-":
+            self.fd = sys.stdout.fileno()
+        elif target.startswith("unix:"):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(target[len("unix:"):])
+        elif target.startswith("tcp://"):
+            host, _, port = target[len("tcp://"):].rpartition(":")
+            self.sock = socket.create_connection((host, int(port)))
+        else:
+            self.fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            self.owns_fd = True
+
+    def write_records(self, records):
+        payload = b"".join(encode_record(record) for record in records)
+        with self.lock:
+            if self.sock is not None:
+                self.sock.sendall(payload)
+                return
+            view = memoryview(payload)
+            while view:
+                written = os.write(self.fd, view)
+                view = view[written:]
+
+    def close(self):
+        with self.lock:
+            if self.sock is not None:
+                self.sock.close()
+            elif self.owns_fd:
+                os.close(self.fd)